@@ -0,0 +1,299 @@
+import os
+import gc
+import copy
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import yaml
+
+from similarity_algorithm import SigmaRuleComparator, SCORING_MODES, FEATURES_KEY
+from rule_corpus import RuleCorpus
+
+DEFAULT_SCALES = (1000, 10000, 50000)
+DEFAULT_BASELINE = "benchmark_baseline.json"
+DEFAULT_TOLERANCE = 0.2  # %20'den fazla yavaşlama regresyon sayılır
+
+# Gerçek Sigma kurallarındaki logsource / field / value dağılımına benzer örnekler
+LOGSOURCES = [
+    ({"product": "windows", "category": "process_creation"},
+     ["Image|endswith", "OriginalFileName", "CommandLine|contains", "CommandLine|contains|all",
+      "ParentImage|endswith", "ParentCommandLine|contains", "User|contains", "IntegrityLevel"]),
+    ({"product": "windows", "category": "file_event"},
+     ["TargetFilename|endswith", "TargetFilename|contains", "Image|endswith"]),
+    ({"product": "windows", "category": "registry_set"},
+     ["TargetObject|contains", "TargetObject|endswith", "Details|contains", "Image|endswith"]),
+    ({"product": "windows", "category": "dns_query"},
+     ["QueryName|endswith", "QueryName|contains", "Image|endswith"]),
+    ({"product": "windows", "category": "network_connection"},
+     ["DestinationPort", "DestinationHostname|endswith", "Initiated", "Image|endswith"]),
+    ({"product": "windows", "service": "security"},
+     ["EventID", "ServiceFileName|contains", "ObjectName|contains", "SubjectUserName|endswith"]),
+    ({"product": "linux", "category": "process_creation"},
+     ["Image|endswith", "CommandLine|contains", "ParentImage|endswith"]),
+    ({"category": "firewall"},
+     ["dst_port", "src_ip|cidr", "action"]),
+    ({"product": "aws", "service": "cloudtrail"},
+     ["eventSource", "eventName", "requestParameters.attribute|contains"]),
+]
+
+BINARIES = ["powershell.exe", "pwsh.exe", "cmd.exe", "rundll32.exe", "regsvr32.exe", "mshta.exe", "wmic.exe",
+            "certutil.exe", "bitsadmin.exe", "schtasks.exe", "reg.exe", "msbuild.exe", "installutil.exe",
+            "cscript.exe", "wscript.exe", "vssadmin.exe", "ntdsutil.exe", "procdump.exe", "net.exe", "nltest.exe"]
+ARGUMENTS = ["-enc", "-EncodedCommand", "IEX", "DownloadString", "Invoke-WebRequest", "-urlcache", "-decode",
+             "/create", "/sc minute", "shadowcopy delete", "delete shadows", "comsvcs.dll", "MiniDump",
+             "scrobj.dll", "/i:http", "javascript:", "vbscript:", "sekurlsa::logonpasswords", "ifm create full",
+             "-nop -w hidden", "bypass", "/transfer", "Add-MpPreference", "-ExclusionPath", "reg save hklm\\sam"]
+PATHS = ["\\AppData\\Local\\Temp\\", "\\Users\\Public\\", "C:\\Windows\\Temp\\", "\\ProgramData\\",
+         "\\Start Menu\\Programs\\Startup\\", "\\CurrentVersion\\Run", "\\Services\\", "/tmp/", "/dev/shm/"]
+DOMAINS = [".onion", "pastebin.com", "ngrok.io", "transfer.sh", "raw.githubusercontent.com", "duckdns.org"]
+OTHER = ["4688", "4697", "7045", "4444", "3389", "445", "ConsoleHost_history.txt", "ntds.dit", "lsass",
+         "CreateAccessKey", "iam.amazonaws.com", "deny", "High", "System", "NT AUTHORITY"]
+TECHNIQUES = ["attack.t1059.001", "attack.t1059.003", "attack.t1218.011", "attack.t1218.010", "attack.t1003.001",
+              "attack.t1003.003", "attack.t1105", "attack.t1053.005", "attack.t1547.001", "attack.t1490",
+              "attack.t1562.001", "attack.t1071.004", "attack.t1027", "attack.t1112", "attack.t1098"]
+TACTICS = ["attack.execution", "attack.defense_evasion", "attack.credential_access", "attack.persistence",
+           "attack.command_and_control", "attack.impact", "attack.privilege_escalation"]
+
+
+def _random_value(rnd, field):
+    name = field.split("|")[0].lower()
+    if "image" in name or ("filename" in name and "target" not in name):
+        value = "\\" + rnd.choice(BINARIES)
+    elif "commandline" in name or "details" in name:
+        value = rnd.choice(ARGUMENTS)
+    elif "target" in name or "object" in name or "path" in name:
+        value = rnd.choice(PATHS) + (rnd.choice(BINARIES) if rnd.random() < 0.3 else "")
+    elif "query" in name or "hostname" in name:
+        value = rnd.choice(DOMAINS)
+    else:
+        value = rnd.choice(OTHER)
+    # Kuralların birebir kopya olmaması için küçük varyasyonlar
+    if rnd.random() < 0.2:
+        value += str(rnd.randint(0, 99))
+    return value
+
+
+def make_synthetic_rules(count, seed=42):
+    """Gerçekçi dağılımlı, tekrarlanabilir sentetik Sigma kuralları üret"""
+    rnd = random.Random(seed)
+    rules = []
+    for i in range(count):
+        logsource, fields = rnd.choice(LOGSOURCES)
+        detection = {}
+        selections = []
+        for s in range(rnd.choices([1, 2, 3], weights=[6, 3, 1])[0]):
+            selection = {}
+            for field in rnd.sample(fields, min(len(fields), rnd.randint(1, 3))):
+                if rnd.random() < 0.6:
+                    selection[field] = [_random_value(rnd, field) for _ in range(rnd.randint(2, 5))]
+                else:
+                    selection[field] = _random_value(rnd, field)
+            name = f"selection_{s}" if s else "selection"
+            detection[name] = selection
+            selections.append(name)
+        if rnd.random() < 0.3:
+            field = rnd.choice(fields)
+            detection["filter"] = {field: _random_value(rnd, field)}
+            detection["condition"] = f"{' and '.join(selections)} and not filter"
+        else:
+            detection["condition"] = " and ".join(selections)
+
+        rules.append({
+            "_id": f"synthetic_{i:06d}.yml",
+            "title": f"Synthetic Rule {i}",
+            "id": f"00000000-0000-0000-0000-{i:012d}",
+            "status": rnd.choice(["test", "experimental", "stable"]),
+            "description": "Benchmark için üretilmiş sentetik kural",
+            "author": "benchmark",
+            "date": f"2023-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+            "tags": rnd.sample(TACTICS, 1) + rnd.sample(TECHNIQUES, rnd.randint(1, 2)),
+            "logsource": dict(logsource),
+            "detection": detection,
+            "falsepositives": ["Unknown"],
+            "level": rnd.choice(["low", "medium", "high", "critical"]),
+        })
+    return rules
+
+
+def make_queries(rules, count, seed=7):
+    """Corpus'tan kural seçip hafifçe değiştirerek query YAML dosyaları üret"""
+    rnd = random.Random(seed)
+    directory = tempfile.mkdtemp(prefix="sigma_bench_")
+    paths = []
+    for i, rule in enumerate(rnd.sample(rules, min(count, len(rules)))):
+        query = copy.deepcopy({k: v for k, v in rule.items() if k != "_id"})
+        query["title"] = f"Benchmark Query {i}"
+        for selection in query["detection"].values():
+            if isinstance(selection, dict):
+                for field, value in selection.items():
+                    if isinstance(value, list) and len(value) > 1 and rnd.random() < 0.5:
+                        selection[field] = value[:-1]
+        path = os.path.join(directory, f"query_{i}.yml")
+        with open(path, "w", encoding="utf-8") as f:
+            yaml.safe_dump(query, f, allow_unicode=True)
+        paths.append(path)
+    return paths
+
+
+def build_collection(rules):
+    """Kuralları feature'larıyla birlikte bellekteki bir mongomock koleksiyonuna yükle"""
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("❌ Benchmark için mongomock gerekli: pip install mongomock")
+
+    comparator = SigmaRuleComparator(None)
+    collection = mongomock.MongoClient().sigmaDB.rules
+    batch = []
+    for rule in rules:
+        doc = dict(rule)
+        doc[FEATURES_KEY] = comparator.build_rule_features(doc)
+        batch.append(doc)
+        if len(batch) >= 1000:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+    return collection
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def run_scenario(collection, queries, mode, warm, workers, memory_queries):
+    """Bir (ölçek, mod) senaryosunu çalıştırıp gecikme ve bellek ölçümlerini döndür"""
+    rule_corpus = RuleCorpus(collection, watch_changes=False) if warm else None
+    comparator = SigmaRuleComparator(collection, mode=mode, workers=workers, rule_corpus=rule_corpus)
+
+    # İlk sorgu corpus/indeks kurulumunu içerir; ayrıca raporlanır
+    start = time.perf_counter()
+    comparator.compare_with_mongodb(queries[0], top_n=10)
+    setup_seconds = time.perf_counter() - start
+
+    latencies = []
+    for path in queries:
+        start = time.perf_counter()
+        comparator.compare_with_mongodb(path, top_n=10)
+        latencies.append(time.perf_counter() - start)
+
+    # tracemalloc zamanlamayı bozduğu için bellek ayrı bir turda ölçülür
+    gc.collect()
+    tracemalloc.start()
+    for path in queries[:memory_queries]:
+        comparator.compare_with_mongodb(path, top_n=10)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(latencies)
+    return {
+        "queries": len(latencies),
+        "qps": len(latencies) / total if total else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "first_query_ms": setup_seconds * 1000,
+        "peak_memory_mb": peak / (1024 * 1024),
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Baseline'a göre yavaşlayan senaryoları döndür"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        if current["p50_ms"] > previous["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p50 {previous['p50_ms']:.1f} → {current['p50_ms']:.1f} ms")
+        if current["qps"] < previous["qps"] * (1 - tolerance):
+            regressions.append(f"{name}: qps {previous['qps']:.2f} → {current['qps']:.2f}")
+        if current["peak_memory_mb"] > previous["peak_memory_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: bellek {previous['peak_memory_mb']:.1f} → {current['peak_memory_mb']:.1f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SigmaRuleComparator için sentetik corpus ile performans ölçümü")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES), help="Corpus boyutları")
+    parser.add_argument("--modes", nargs="+", choices=SCORING_MODES, default=["exact", "indexed"],
+                        help="Ölçülecek skorlama modları")
+    parser.add_argument("--queries", type=int, default=20, help="Senaryo başına query sayısı")
+    parser.add_argument("--memory-queries", type=int, default=3, help="Bellek ölçümündeki query sayısı")
+    parser.add_argument("--workers", type=int, default=1, help="Skorlama için süreç sayısı")
+    parser.add_argument("--warm", action="store_true", help="Exact modu paylaşılan RuleCorpus üzerinden çalıştır")
+    parser.add_argument("--seed", type=int, default=42, help="Sentetik corpus seed'i")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="Sonuçları baseline olarak kaydet")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, help="Sonuçları baseline ile karşılaştır")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="İzin verilen yavaşlama oranı")
+    parser.add_argument("--output", help="Sonuçların yazılacağı JSON dosyası")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    results = {}
+
+    for scale in args.scales:
+        print(f"🧪 {scale} kuralık sentetik corpus hazırlanıyor...")
+        rules = make_synthetic_rules(scale, seed=args.seed)
+        collection = build_collection(rules)
+        queries = make_queries(rules, args.queries)
+
+        for mode in args.modes:
+            name = f"{scale}/{mode}{'/warm' if args.warm and mode == 'exact' else ''}"
+            metrics = run_scenario(collection, queries, mode, args.warm and mode == "exact", args.workers,
+                                   args.memory_queries)
+            results[name] = metrics
+            print(f"   {name:<22} {metrics['qps']:8.2f} q/s   p50 {metrics['p50_ms']:9.1f} ms   "
+                  f"p99 {metrics['p99_ms']:9.1f} ms   ilk {metrics['first_query_ms']:9.1f} ms   "
+                  f"bellek {metrics['peak_memory_mb']:7.1f} MB")
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "settings": {"queries": args.queries, "workers": args.workers, "seed": args.seed},
+        "scenarios": results,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    exit_code = 0
+    if args.compare:
+        if not os.path.exists(args.compare):
+            print(f"⚠️ Baseline bulunamadı: {args.compare}")
+        else:
+            with open(args.compare, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+            regressions = compare_to_baseline(results, baseline, args.tolerance)
+            if regressions:
+                print("❌ Performans regresyonu:")
+                for line in regressions:
+                    print(f"   {line}")
+                exit_code = 1
+            else:
+                print(f"✅ Baseline'a göre regresyon yok (tolerans %{args.tolerance * 100:.0f})")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Baseline kaydedildi: {args.save_baseline}")
+
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,17 @@
 import os
-import requests
 from dotenv import load_dotenv
+from http_client import shared_http, DEFAULT_CONNECT_TIMEOUT
 
 load_dotenv()
 
+# Kural üretimi uzun sürebilir; okuma timeout'u genel varsayılandan yüksek tutulur
+GENERATION_TIMEOUT = 300
+
 class SigmaRuleGenerator:
-    def __init__(self, ollama_url=None, ollama_model=None):
+    def __init__(self, ollama_url=None, ollama_model=None, timeout=GENERATION_TIMEOUT):
         self.ollama_url = ollama_url or os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
         self.ollama_model = ollama_model or os.getenv("OLLAMA_MODEL", "llama3")
+        self.timeout = timeout
 
     def generate(self, idea_text):
         """
@@ -32,11 +36,11 @@ Başka hiçbir açıklama, yorum ya da metin olmasın. Çıktı şu şekilde olm
 <sigma_yaml_kurali>
 
 """
-        response = requests.post(self.ollama_url, json={
+        response = shared_http.post(self.ollama_url, json={
             "model": self.ollama_model,
             "prompt": prompt,
             "stream": False
-        })
+        }, timeout=(DEFAULT_CONNECT_TIMEOUT, self.timeout), idempotent=True)
 
         response.raise_for_status()
         return response.json().get("response", "Yanıt alınamadı")
@@ -1,13 +1,28 @@
 import os
+import time
+import argparse
 import requests
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne
 import yaml
-from datetime import date
+from datetime import date, datetime, timezone
+from similarity_algorithm import SigmaRuleComparator, FEATURES_KEY
+from mongodb_connection import INGESTED_AT_KEY, ensure_rule_indexes
+from http_client import shared_http
 
 load_dotenv()
 
+# Yerel bir test sunucusuna yönlendirmek için değiştirilebilir
+DEFAULT_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+DEFAULT_RAW_URL = os.getenv("GITHUB_RAW_URL", "https://raw.githubusercontent.com")
+DEFAULT_DOWNLOAD_WORKERS = 8
+WRITE_BATCH_SIZE = 500
+MAX_RATE_LIMIT_WAIT = 15 * 60  # saniye; daha uzun bir bekleme istenirse istek hata verir
+MAX_RATE_LIMIT_RETRIES = 3  # istek başına rate limit beklemesi sayısı
+
 class SigmaFetcher:
     def __init__(
         self,
@@ -17,28 +32,105 @@ class SigmaFetcher:
         owner="EmircanDemirci",
         repo="sigma",
         branch="main",
-        save_dir="downloaded_sigma_rules"
+        save_dir="downloaded_sigma_rules",
+        api_url=DEFAULT_API_URL,
+        raw_url=DEFAULT_RAW_URL,
+        rules_path="rules",
+        workers=DEFAULT_DOWNLOAD_WORKERS
     ):
         load_dotenv()
         self.token = os.getenv("GITHUB_TOKEN")
-        self.headers = {"Authorization": f"token {self.token}"}
+        self.headers = {"Authorization": f"token {self.token}"} if self.token else {}
 
         self.repo_owner = owner
         self.repo_name = repo
         self.branch = branch
         self.save_dir = save_dir
-        self.api_base_url = f"https://api.github.com/repos/{self.repo_owner}/{self.repo_name}/contents/rules"
+        self.rules_path = rules_path.strip("/")
+        self.workers = workers
+        self.api_url = api_url.rstrip("/")
+        self.raw_url = raw_url.rstrip("/")
+        self.api_base_url = f"{self.api_url}/repos/{self.repo_owner}/{self.repo_name}/contents/{self.rules_path}"
+        self.tree_url = f"{self.api_url}/repos/{self.repo_owner}/{self.repo_name}/git/trees/{self.branch}?recursive=1"
 
         self.mongo_client = MongoClient(mongo_url)
         self.db = self.mongo_client[db_name]
         self.collection = self.db[collection_name]
+        self.comparator = SigmaRuleComparator(self.collection)
+        ensure_rule_indexes(self.collection)
+
+    def _get(self, url):
+        """GitHub isteği; rate limit (403) dolduysa X-RateLimit-Reset / Retry-After kadar bekleyip tekrar dener.
+
+        En fazla MAX_RATE_LIMIT_RETRIES kez ve toplamda MAX_RATE_LIMIT_WAIT
+        saniye beklenir. 429 cevapları paylaşılan HTTP istemcisi tarafından
+        Retry-After'a uyularak zaten tekrar denendiği için burada beklenmez.
+        """
+        waited = 0.0
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            response = shared_http.get(url, headers=self.headers)
+            if response.status_code != 403 or attempt == MAX_RATE_LIMIT_RETRIES:
+                break
+            wait = self._rate_limit_wait(response)
+            if wait is None or waited + wait > MAX_RATE_LIMIT_WAIT:
+                break
+            print(f"[INFO] GitHub rate limit doldu, {wait:.0f} sn bekleniyor...")
+            time.sleep(wait)
+            waited += wait
+        self._throttle(response)
+        return response
+
+    def _rate_limit_wait(self, response):
+        """Rate limit cevabı ise beklenecek süre (sn), değilse None"""
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None:
+            return float(retry_after)
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            reset = float(response.headers.get("X-RateLimit-Reset", time.time()))
+            return max(reset - time.time(), 0) + 1
+        return None
+
+    def _throttle(self, response):
+        """Kota bitmek üzereyse kalan istekleri sıfırlanma zamanına kadar yay"""
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None or int(remaining) > self.workers * 2:
+            return
+        window = max(float(reset) - time.time(), 0)
+        if window <= MAX_RATE_LIMIT_WAIT:
+            time.sleep(window / (int(remaining) + 1))
+
+    def fetch_file_list(self):
+        """rules/ altındaki tüm .yml dosyalarının indirme URL'leri; tek bir recursive git trees isteği.
+
+        GitHub çok büyük ağaçlarda listeyi kısaltır (truncated); bu durumda
+        dizin dizin gezen contents API'sine geri düşülür.
+        """
+        try:
+            response = self._get(self.tree_url)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"[HATA] Github API isteği başarısız: {e}")
+            return []
 
-    def fetch_file_list(self, api_url=None):
+        tree = response.json()
+        if tree.get("truncated"):
+            print("[INFO] Dosya ağacı kısaltılmış geldi, contents API ile listeleniyor...")
+            return self.fetch_file_list_contents()
+
+        prefix = f"{self.rules_path}/"
+        return [
+            f"{self.raw_url}/{self.repo_owner}/{self.repo_name}/{self.branch}/{quote(item['path'])}"
+            for item in tree.get("tree", [])
+            if item["type"] == "blob" and item["path"].startswith(prefix) and item["path"].endswith(".yml")
+        ]
+
+    def fetch_file_list_contents(self, api_url=None):
         if api_url is None:
             api_url = self.api_base_url
 
         try:
-            response = requests.get(api_url, headers=self.headers)
+            response = self._get(api_url)
             response.raise_for_status()
         except requests.RequestException as e:
             print(f"[HATA] Github API isteği başarısız: {e}")
@@ -51,7 +143,7 @@ class SigmaFetcher:
             if file["type"] == "file" and file["name"].endswith(".yml"):
                 all_files.append(file["download_url"])
             elif file["type"] == "dir":
-                sub_files = self.fetch_file_list(file["url"])
+                sub_files = self.fetch_file_list_contents(file["url"])
                 if sub_files:
                     all_files.extend(sub_files)
 
@@ -66,27 +158,76 @@ class SigmaFetcher:
             return obj.isoformat()
         return obj
 
+    def download_rule(self, url):
+        """Tek bir kural dosyasını indirip ayrıştır (thread havuzunda çalışır)"""
+        response = self._get(url)
+        response.raise_for_status()
+        return yaml.safe_load(response.text)
+
+    def _write(self, documents):
+        """Kuralları toplu yaz; zaten kayıtlı kuralların ilk ingest zamanı korunur.
+
+        Her senkronizasyon tüm kuralları yeniden indirir ve indirmeler rastgele
+        sırayla biter; zaman damgası her seferinde yenilenirse "son eklenen
+        kurallar" sıralaması son biten indirmeleri gösterirdi.
+        """
+        try:
+            ids = [doc["_id"] for doc in documents]
+            first_seen = {
+                doc["_id"]: doc[INGESTED_AT_KEY]
+                for doc in self.collection.find({"_id": {"$in": ids}, INGESTED_AT_KEY: {"$exists": True}},
+                                                {INGESTED_AT_KEY: 1})
+            }
+            now = datetime.now(timezone.utc)
+            operations = []
+            for doc in documents:
+                doc[INGESTED_AT_KEY] = first_seen.get(doc["_id"], now)
+                operations.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+            self.collection.bulk_write(operations, ordered=False)
+        except Exception as ex:
+            print(f"[HATA] MongoDB'ye kayıt yapılamadı: {len(documents)} kural -> {ex}")
+
     def download_and_store_to_mongo(self, urls):
-        for url in tqdm(urls, desc="Sigma kural dosyaları indiriliyor ve MongoDB'ye kaydediliyor..."):
-            try:
-                response = requests.get(url, headers=self.headers)
-                response.raise_for_status()
-
-                yaml_data = yaml.safe_load(response.text)
-
-                if yaml_data:
-                    yaml_data = self.convert_dates(yaml_data)  # Tarih formatlarını düzelt
-                    doc_id = url.split("/")[-1]
-                    yaml_data["_id"] = doc_id
-                    yaml_data["source_url"] = url
-
-                    self.collection.replace_one({"_id": doc_id}, yaml_data, upsert=True)
-            except requests.RequestException as e:
-                print(f"[HATA] Dosya indirilemedi: {url} -> {e}")
-            except yaml.YAMLError as ye:
-                print(f"[HATA] YAML ayrıştırılamadı: {url} -> {ye}")
-            except Exception as ex:
-                print(f"[HATA] MongoDB'ye kayıt yapılamadı: {url} -> {ex}")
+        """Dosyaları `workers` thread ile paralel indir; kuralları gruplar halinde MongoDB'ye yaz"""
+        documents = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.download_rule, url): url for url in urls}
+            for future in tqdm(as_completed(futures), total=len(futures),
+                               desc="Sigma kural dosyaları indiriliyor ve MongoDB'ye kaydediliyor..."):
+                url = futures[future]
+                try:
+                    yaml_data = future.result()
+
+                    if yaml_data:
+                        yaml_data = self.convert_dates(yaml_data)  # Tarih formatlarını düzelt
+                        doc_id = url.split("/")[-1]
+                        yaml_data["_id"] = doc_id
+                        yaml_data["source_url"] = url
+                        # Benzerlik sorgularında tekrar hesaplanmaması için feature'ları ingest'te sakla
+                        yaml_data[FEATURES_KEY] = self.comparator.build_rule_features(yaml_data)
+
+                        documents.append(yaml_data)
+                        if len(documents) >= WRITE_BATCH_SIZE:
+                            self._write(documents)
+                            documents = []
+                except requests.RequestException as e:
+                    print(f"[HATA] Dosya indirilemedi: {url} -> {e}")
+                except yaml.YAMLError as ye:
+                    print(f"[HATA] YAML ayrıştırılamadı: {url} -> {ye}")
+                except Exception as ex:
+                    print(f"[HATA] Kural işlenemedi: {url} -> {ex}")
+
+        if documents:
+            self._write(documents)
+
+    def backfill_features(self):
+        print("[INFO] Eksik veya eski detection feature'ları hesaplanıyor...")
+        updated = self.comparator.backfill_features()
+        print(f"[BİTTİ] {updated} kuralın feature'ları güncellendi.")
+        # Zaman damgasından önce eklenmiş kurallar, sıralamada yer alabilmeleri için şimdiki zamanı alır
+        stamped = self.collection.update_many({INGESTED_AT_KEY: {"$exists": False}},
+                                              {"$set": {INGESTED_AT_KEY: datetime.now(timezone.utc)}})
+        print(f"[BİTTİ] {stamped.modified_count} kurala ingest zamanı eklendi.")
 
     def run(self):
         print("[INFO] Sigma kuralları toplanıyor...")
@@ -96,5 +237,16 @@ class SigmaFetcher:
         print(f"[BİTTİ] Tüm kurallar MongoDB'ye kaydedildi.")
 
 if __name__ == "__main__":
-    fetcher = SigmaFetcher()
-    fetcher.run()
+    parser = argparse.ArgumentParser(description="Sigma kurallarını GitHub'dan indirip MongoDB'ye kaydeder")
+    parser.add_argument("--backfill", action="store_true",
+                        help="İndirme yapmadan mevcut kuralların detection feature'larını hesapla")
+    parser.add_argument("--workers", type=int, default=DEFAULT_DOWNLOAD_WORKERS, help="Paralel indirme sayısı")
+    parser.add_argument("--api-url", default=DEFAULT_API_URL, help="GitHub API adresi (test sunucusu için)")
+    parser.add_argument("--raw-url", default=DEFAULT_RAW_URL, help="Ham dosya adresi (test sunucusu için)")
+    args = parser.parse_args()
+
+    fetcher = SigmaFetcher(api_url=args.api_url, raw_url=args.raw_url, workers=args.workers)
+    if args.backfill:
+        fetcher.backfill_features()
+    else:
+        fetcher.run()
@@ -0,0 +1,335 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import argparse
+from collections import defaultdict
+from multiprocessing import Pool
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from mongodb_connection import MongoConnector
+from similarity_algorithm import (
+    SigmaRuleComparator,
+    FEATURES_KEY,
+    VALUE_WEIGHT,
+    FIELD_WEIGHT,
+    SIMILARITY_THRESHOLD,
+)
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r"\w{3,}")
+
+# Worker süreçlerinde initializer ile bir kez doldurulur
+_worker_rules = None
+_worker_comparator = None
+_worker_threshold = SIMILARITY_THRESHOLD
+
+
+def logsource_key(logsource):
+    """logsource bölümünü product/category/service üçlüsüne indir"""
+    logsource = logsource if isinstance(logsource, dict) else {}
+    return "/".join(str(logsource.get(k) or "-").lower() for k in ("product", "category", "service"))
+
+
+def _init_worker(rules, threshold):
+    global _worker_rules, _worker_comparator, _worker_threshold
+    _worker_rules = rules
+    _worker_comparator = SigmaRuleComparator(None)
+    _worker_threshold = threshold
+
+
+def _score_pair(comparator, rule_a, rule_b):
+    """İki kuralı iki yönde de skorla, yüksek olan yönü raporla"""
+    field_sim = comparator.calculate_field_similarity(rule_a["fields"], rule_b["fields"])
+    forward = comparator.fuzzy_similarity(rule_a["values"], rule_b["values"])
+    reverse = comparator.fuzzy_similarity(rule_b["values"], rule_a["values"])
+    value_sim = max(forward, reverse)
+    return field_sim, value_sim, (value_sim * VALUE_WEIGHT) + (field_sim * FIELD_WEIGHT)
+
+
+def _score_chunk(task):
+    """Bir grup çapa kuralı ile aday ortaklarını skorla (worker içinde çalışır)"""
+    anchors, partner_lists = task
+    pairs = []
+    for anchor, partners in zip(anchors, partner_lists):
+        rule_a = _worker_rules[anchor]
+        for partner in partners:
+            rule_b = _worker_rules[partner]
+            field_sim, value_sim, weighted = _score_pair(_worker_comparator, rule_a, rule_b)
+            if weighted >= _worker_threshold:
+                pairs.append({
+                    "rule_a": rule_a["rule_id"],
+                    "rule_b": rule_b["rule_id"],
+                    "title_a": rule_a["title"],
+                    "title_b": rule_b["title"],
+                    "field_similarity": field_sim,
+                    "value_similarity": value_sim,
+                    "weighted_similarity": weighted,
+                })
+    return [_worker_rules[a]["rule_id"] for a in anchors], pairs
+
+
+class JsonlPairSink:
+    """Skorlanan çiftleri JSON Lines dosyasına yazar.
+
+    Yanındaki .progress dosyası tamamlanan çapa kurallarını ve o andaki
+    dosya uzunluğunu tutar; resume=True ile yarıda kalan çalışmada dosya son
+    tutarlı noktaya kırpılır, böylece kısmi yazılan çiftler tekrar etmez.
+    Var olan bir sonuç dosyasının üzerine resume veya overwrite olmadan
+    yazılmaz; overwrite=True dosyayı ve ilerleme kaydını silip baştan başlar.
+    """
+
+    def __init__(self, path, resume=False, overwrite=False):
+        self.path = path
+        self.progress_path = f"{path}.progress"
+        self.resume = resume
+        self.overwrite = overwrite
+
+    def completed(self):
+        if self.overwrite:
+            for path in (self.path, self.progress_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        has_output = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        has_progress = os.path.exists(self.progress_path)
+        if not self.resume and (has_output or has_progress):
+            raise FileExistsError(f"{self.path} zaten var; devam etmek için --resume, "
+                                  f"baştan başlamak için --overwrite kullanın")
+        if has_output and not has_progress:
+            # İlerleme kaydı olmadan tutarlı nokta bilinemez; dosyayı kırpmak veri kaybettirir
+            raise FileExistsError(f"{self.progress_path} bulunamadı; {self.path} ile devam edilemez")
+
+        done = set()
+        offset = 0
+        if has_progress:
+            with open(self.progress_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # Yarım yazılmış son satır
+                    done.update(record["anchors"])
+                    offset = record["offset"]
+
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.truncate(offset)
+        return done
+
+    def write(self, anchors, pairs):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for pair in pairs:
+                f.write(json.dumps(pair, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            offset = f.tell()
+
+        with open(self.progress_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"anchors": anchors, "offset": offset}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class MongoPairSink:
+    """Skorlanan çiftleri bir Mongo koleksiyonuna upsert eder (çift _id'si "a|b").
+
+    Tamamlanan çapalar "<koleksiyon>_progress"te tutulur. JsonlPairSink gibi,
+    önceki bir çalışmanın kaydı varsa resume olmadan başlamaz (yeni eklenen
+    kurallarla eski çapaların çiftleri hiç skorlanmazdı); overwrite=True iki
+    koleksiyonu da boşaltıp baştan başlar.
+    """
+
+    def __init__(self, collection, resume=False, overwrite=False):
+        self.collection = collection
+        self.progress = collection.database[f"{collection.name}_progress"]
+        self.resume = resume
+        self.overwrite = overwrite
+
+    def completed(self):
+        if self.overwrite:
+            self.collection.delete_many({})
+            self.progress.delete_many({})
+        done = {doc["_id"] for doc in self.progress.find({}, {"_id": 1})}
+        if not self.resume and (done or self.collection.find_one({}, {"_id": 1}) is not None):
+            raise FileExistsError(f"{self.collection.name} koleksiyonunda önceki bir denetim var; devam etmek için "
+                                  f"--resume, baştan başlamak için --overwrite kullanın")
+        return done
+
+    def write(self, anchors, pairs):
+        if pairs:
+            self.collection.bulk_write([
+                UpdateOne({"_id": f"{p['rule_a']}|{p['rule_b']}"}, {"$set": p}, upsert=True)
+                for p in pairs
+            ], ordered=False)
+        self.progress.bulk_write([
+            UpdateOne({"_id": anchor}, {"$set": {"_id": anchor}}, upsert=True) for anchor in anchors
+        ], ordered=False)
+
+
+class DuplicateAuditor:
+    """Tüm kural tabanını kendi içinde karşılaştırarak olası kopyaları bulur.
+
+    N² karşılaştırma yerine blocking kullanılır: en az bir value token'ını
+    (3+ karakterli kelime) paylaşan kurallar aday çift olur. max_block_size'tan
+    kalabalık token'lar (ör. "powershell") tek başına blok oluşturmaz; bu
+    token'lar kural içinde ikişerli anahtarlara bölünür, o da kalabalıksa
+    atlanır. Normalize edilmiş field/value kümelerinin hash'i ayrıca her zaman
+    blok oluşturur, böylece birebir kopyalar blok boyutundan bağımsız olarak
+    aday olur. Yalnızca kalabalık token paylaşan ve birebir aynı olmayan
+    kurallar karşılaştırılmayabilir. same_logsource ile çiftler aynı
+    product/category/service altındaki kurallarla sınırlanabilir.
+    """
+
+    def __init__(self, collection, sink, workers=None, threshold=SIMILARITY_THRESHOLD,
+                 max_block_size=500, same_logsource=False, chunk_size=50):
+        self.collection = collection
+        self.sink = sink
+        self.workers = workers or os.cpu_count() or 1
+        self.threshold = threshold
+        self.max_block_size = max_block_size
+        self.same_logsource = same_logsource
+        self.chunk_size = chunk_size
+        self.comparator = SigmaRuleComparator(collection)
+
+    def load_rules(self):
+        """Kuralları _id sırasına göre feature'larıyla birlikte yükle"""
+        projection = {"title": 1, "logsource": 1, "detection": 1, FEATURES_KEY: 1}
+        rules = []
+        for doc in self.collection.find({}, projection).sort("_id", 1):
+            rule_fields, rule_values = self.comparator.get_rule_features(doc)
+            rules.append({
+                "rule_id": str(doc["_id"]),
+                "title": doc.get("title", "Untitled"),
+                "logsource": logsource_key(doc.get("logsource")),
+                "fields": rule_fields,
+                "values": rule_values,
+            })
+        return rules
+
+    def _scoped(self, rule, key):
+        return f"{rule['logsource']}|{key}" if self.same_logsource else key
+
+    def block_keys(self, rule):
+        tokens = {t for value in rule["values"] for t in _TOKEN_PATTERN.findall(str(value).lower())}
+        return {self._scoped(rule, t): t for t in tokens}
+
+    def fingerprint(self, rule):
+        """Normalize edilmiş field/value kümelerinin hash'i; birebir kopyalar aynı değeri alır"""
+        payload = json.dumps([
+            sorted({str(f).lower() for f in rule["fields"]}),
+            sorted({str(v).lower() for v in rule["values"]}),
+        ], ensure_ascii=False)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def candidate_partners(self, rules):
+        """Her kural için, blok paylaştığı ve kendisinden sonra gelen kuralların listesi"""
+        rule_keys = [self.block_keys(rule) for rule in rules]
+        blocks = defaultdict(list)
+        for position, keys in enumerate(rule_keys):
+            for key in keys:
+                blocks[key].append(position)
+        crowded = {key for key, members in blocks.items() if len(members) > self.max_block_size}
+
+        # Kalabalık token'lar ikişerli anahtarlarla (ör. "exe+powershell") yeniden bloklanır
+        pair_blocks = defaultdict(list)
+        for position, keys in enumerate(rule_keys):
+            common = sorted(keys[key] for key in keys if key in crowded)
+            for i, first in enumerate(common):
+                for second in common[i + 1:]:
+                    pair_blocks[self._scoped(rules[position], f"{first}+{second}")].append(position)
+
+        # Birebir kopyalar her zaman aday olur; bu bloklar boyut sınırına takılmaz
+        exact_blocks = defaultdict(list)
+        for position, rule in enumerate(rules):
+            exact_blocks[self._scoped(rule, f"#{self.fingerprint(rule)}")].append(position)
+
+        skipped = 0
+        partners = defaultdict(set)
+        groups = [(blocks, True), (pair_blocks, True), (exact_blocks, False)]
+        for group, limited in groups:
+            for members in group.values():
+                if len(members) < 2:
+                    continue
+                if limited and len(members) > self.max_block_size:
+                    skipped += 1
+                    continue
+                for i, a in enumerate(members):
+                    partners[a].update(members[i + 1:])
+
+        pair_count = sum(len(p) for p in partners.values())
+        logger.info(f"{len(blocks) + len(pair_blocks)} token bloğu, {skipped} kalabalık blok atlandı, "
+                    f"{pair_count} aday çift")
+        return {a: sorted(p) for a, p in partners.items()}
+
+    def run(self):
+        rules = self.load_rules()
+        partners = self.candidate_partners(rules)
+        completed = self.sink.completed()
+
+        anchors = [a for a in sorted(partners) if rules[a]["rule_id"] not in completed]
+        tasks = [
+            (chunk, [partners[a] for a in chunk])
+            for chunk in (anchors[i:i + self.chunk_size] for i in range(0, len(anchors), self.chunk_size))
+        ]
+        logger.info(f"{len(rules)} kural, {len(completed)} çapa önceden tamamlanmış, {len(tasks)} iş parçası kaldı")
+
+        found = 0
+        if self.workers > 1 and len(tasks) > 1:
+            with Pool(self.workers, initializer=_init_worker, initargs=(rules, self.threshold)) as pool:
+                for done_anchors, pairs in pool.imap_unordered(_score_chunk, tasks):
+                    self.sink.write(done_anchors, pairs)
+                    found += len(pairs)
+        else:
+            _init_worker(rules, self.threshold)
+            for task in tasks:
+                done_anchors, pairs = _score_chunk(task)
+                self.sink.write(done_anchors, pairs)
+                found += len(pairs)
+
+        logger.info(f"Denetim tamamlandı: bu çalışmada {found} olası kopya çifti yazıldı")
+        return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kural tabanındaki olası kopya kuralları bulur")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--output", help="Sonuçların yazılacağı JSON Lines dosyası")
+    output.add_argument("--mongo-collection", help="Sonuçların yazılacağı Mongo koleksiyonu")
+    parser.add_argument("--workers", type=int, default=None, help="Worker süreç sayısı (varsayılan: CPU sayısı)")
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD, help="Raporlanacak minimum ağırlıklı skor")
+    parser.add_argument("--max-block-size", type=int, default=500, help="Bundan kalabalık token blokları atlanır")
+    parser.add_argument("--same-logsource", action="store_true", help="Sadece aynı logsource'taki kuralları karşılaştır")
+    existing = parser.add_mutually_exclusive_group()
+    existing.add_argument("--resume", action="store_true", help="Önceki denetime kaldığı yerden devam et")
+    existing.add_argument("--overwrite", action="store_true", help="Önceki denetimin sonuçlarını silip baştan başla")
+    args = parser.parse_args()
+
+    connector = MongoConnector(os.getenv("MONGO_URI"), "sigmaDB", "rules")
+    collection = connector.connect()
+    if collection is None:
+        print("❌ MongoDB bağlantısı kurulamadı.")
+        return
+
+    try:
+        if args.output:
+            sink = JsonlPairSink(args.output, resume=args.resume, overwrite=args.overwrite)
+        else:
+            sink = MongoPairSink(collection.database[args.mongo_collection], resume=args.resume,
+                                 overwrite=args.overwrite)
+
+        auditor = DuplicateAuditor(collection, sink, workers=args.workers, threshold=args.threshold,
+                                   max_block_size=args.max_block_size, same_logsource=args.same_logsource)
+        found = auditor.run()
+        print(f"✅ {found} olası kopya çifti yazıldı.")
+    except FileExistsError as e:
+        print(f"❌ {e}")
+    finally:
+        connector.close()
+
+
+if __name__ == "__main__":
+    main()
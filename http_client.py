@@ -0,0 +1,223 @@
+import os
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+DEFAULT_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5  # saniye; urllib3 her denemede iki katına çıkarır
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_HOST_CONCURRENCY = int(os.getenv("HTTP_HOST_CONCURRENCY", "8"))
+DEFAULT_POOL_SIZE = 16
+
+
+def _host(url):
+    """URL'nin şema + adres kısmı; havuzlar ve eşzamanlılık sınırı bununla ayrılır"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _retry_after(value):
+    """Saniye cinsinden Retry-After başlığı (tarih biçimi desteklenmez), yoksa None"""
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except ValueError:
+        return None
+
+
+class HTTPClient:
+    """Host başına keep-alive bağlantı havuzu tutan paylaşılan HTTP istemcisi.
+
+    Her host (şema + adres) için ayrı bir requests.Session açılır; bağlantılar
+    istekler arasında yeniden kullanılır. Bağlantı hataları ve idempotent
+    isteklerde (GET vb.) okuma hataları ile 429/5xx cevapları artan beklemeyle
+    (429'da Retry-After'a uyarak) tekrar denenir. POST'lar yan etkili
+    sayılır: yalnızca idempotent=True ile işaretlenenler 429/5xx'te tekrar
+    denenir, okuma timeout'unda hiçbir POST tekrar gönderilmez. Timeout
+    verilmeyen isteklere varsayılan (bağlantı, okuma) timeout'u uygulanır ve
+    aynı host'a aynı anda en fazla `host_concurrency` istek gider; stream=True
+    cevaplar kapatılana kadar bu sınıra dahildir.
+    """
+
+    def __init__(self, timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT), retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, host_concurrency=DEFAULT_HOST_CONCURRENCY, pool_size=DEFAULT_POOL_SIZE):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.host_concurrency = host_concurrency
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url):
+        return _host(url)
+
+    def _new_session(self, idempotent_post=False):
+        options = {}
+        if idempotent_post:
+            # POST da tekrar denenir ama okuma timeout'unda değil (uzun üretimler katlanmasın)
+            options = {"allowed_methods": None, "read": 0}
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=RETRY_STATUSES,
+            respect_retry_after_header=True,
+            raise_on_status=False,  # Son denemede cevap döner, raise_for_status çağırana kalır
+            **options,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def session(self, url, idempotent_post=False):
+        """URL'nin host'una ait (gerekirse yeni oluşturulan) Session"""
+        host = self._host(url)
+        with self._lock:
+            session = self._sessions.get((host, idempotent_post))
+            if session is None:
+                session = self._sessions[(host, idempotent_post)] = self._new_session(idempotent_post)
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.host_concurrency)
+            return session
+
+    def request(self, method, url, timeout=None, idempotent=False, **kwargs):
+        """İstek gönder; idempotent=True, POST'un 429/5xx'te tekrar denenebileceğini bildirir"""
+        session = self.session(url, idempotent_post=idempotent)
+        semaphore = self._semaphores[self._host(url)]
+        semaphore.acquire()
+        try:
+            response = session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+        except BaseException:
+            semaphore.release()
+            raise
+        if not kwargs.get("stream"):
+            semaphore.release()
+            return response
+
+        # Akış gövdesi okunurken bağlantı meşgul; slot cevap kapatılınca bırakılır
+        close = response.close
+        released = threading.Event()
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released.is_set():
+                    released.set()
+                    semaphore.release()
+
+        response.close = close_and_release
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._semaphores.clear()
+
+
+class AsyncHTTPClient:
+    """HTTPClient'ın asyncio karşılığı; aynı timeout, tekrar deneme ve host sınırı kurallarıyla.
+
+    aiohttp oturumları tek bir event loop'a bağlı olduğundan istemci kendi
+    loop'unu arka plandaki bir daemon thread'de çalıştırır; senkron kod
+    coroutine'leri run() ile bu loop'a gönderir. Böylece ayrı çağrılar (ör. AI
+    Checker'daki her kontrol) host başına aynı keep-alive havuzunu ve
+    eşzamanlılık sınırını paylaşır.
+    """
+
+    def __init__(self, timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT), retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, host_concurrency=DEFAULT_HOST_CONCURRENCY, pool_size=DEFAULT_POOL_SIZE):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.host_concurrency = host_concurrency
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._semaphores = {}
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def loop(self):
+        """İstemcinin (gerekirse başlatılan) event loop'u"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="async-http", daemon=True).start()
+            return self._loop
+
+    def run(self, coroutine):
+        """Coroutine'i istemcinin loop'unda çalıştır; concurrent.futures.Future döner"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop())
+
+    def _session(self, url):
+        # Sadece istemcinin loop'unda çağrılır, kilide gerek yok
+        host = _host(url)
+        session = self._sessions.get(host)
+        if session is None:
+            session = self._sessions[host] = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+            self._semaphores[host] = asyncio.Semaphore(self.host_concurrency)
+        return session, self._semaphores[host]
+
+    async def request(self, method, url, read, timeout=None, idempotent=False, **kwargs):
+        """İsteği gönder, cevabı read(response) coroutine'iyle oku ve read'in sonucunu döndür.
+
+        HTTPClient ile aynı kurallar: bağlantı kurulamazsa her istek, 429/5xx
+        cevaplarında sadece idempotent metotlar (veya idempotent=True ile
+        işaretlenen POST'lar) artan beklemeyle (429'da Retry-After'a uyarak)
+        tekrar denenir. Okuma timeout'u ve gövde okunurken çıkan hatalar tekrar
+        denenmez. Host slotu cevap okunup kapanana kadar tutulur.
+        """
+        session, semaphore = self._session(url)
+        connect_timeout, read_timeout = timeout or self.timeout
+        client_timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        retry_status = idempotent or method.upper() in Retry.DEFAULT_ALLOWED_METHODS
+        async with semaphore:
+            for attempt in range(self.retries + 1):
+                last = attempt >= self.retries
+                wait = None
+                try:
+                    async with session.request(method, url, timeout=client_timeout, **kwargs) as response:
+                        if last or not retry_status or response.status not in RETRY_STATUSES:
+                            return await read(response)
+                        wait = _retry_after(response.headers.get("Retry-After"))
+                except aiohttp.ClientConnectorError:
+                    if last:
+                        raise
+                await asyncio.sleep(self.backoff * (2 ** attempt) if wait is None else wait)
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+
+        async def shutdown():
+            for session in self._sessions.values():
+                await session.close()
+            self._sessions.clear()
+            self._semaphores.clear()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+# Süreç genelinde paylaşılan istemciler (Streamlit sayfaları, CLI'lar ve indirici ortak kullanır)
+shared_http = HTTPClient()
+shared_async_http = AsyncHTTPClient()
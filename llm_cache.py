@@ -0,0 +1,182 @@
+import os
+import json
+import argparse
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+DEFAULT_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_DAYS", "30")) * 24 * 60 * 60
+
+# Mongo'ya özgü / hesaplanmış alanlar; kuralın anlamını değiştirmez, hash'e girmez
+NON_SEMANTIC_KEYS = ("_id", "detection_features", "ingested_at")
+
+
+def normalize_rule(rule):
+    """Kuralı anahtar sırasından bağımsız, kararlı bir JSON string'ine çevir"""
+    cleaned = {k: v for k, v in (rule or {}).items() if k not in NON_SEMANTIC_KEYS}
+    return json.dumps(cleaned, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def verdict_key(rule1, rule2, model, prompt_version):
+    """(rule1, rule2, model, prompt sürümü) için sha256 anahtarı.
+
+    Sıra önemlidir: prompt'ta rule1 sorgu, rule2 karşılaştırılan kuraldır.
+    """
+    payload = "\x1f".join([normalize_rule(rule1), normalize_rule(rule2), str(model), str(prompt_version)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMVerdictCache:
+    """Ollama karşılaştırma sonuçları (skor + açıklama) için kalıcı SQLite önbelleği.
+
+    Aynı kural çifti, model ve prompt sürümü için model tekrar çağrılmaz.
+    Skor eşiğin altında kaldığı için yarıda kesilen (cancelled) üretimler
+    işaretlenerek saklanır ve sadece aynı şekilde kesilecek isteklere döner.
+    Girdiler `ttl` saniye sonra geçersiz sayılır; invalidate() ile model veya
+    prompt sürümüne göre, clear() ile tamamen silinebilir. Dosya ilk
+    kullanımda oluşturulur.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            # Streamlit her script çalıştırmasını ayrı thread'de yapar; erişim kilitle sıralanır
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS verdicts (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    prompt_version TEXT,
+                    score INTEGER,
+                    explanation TEXT,
+                    created_at REAL,
+                    cancelled INTEGER DEFAULT 0
+                )
+            """)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(verdicts)")}
+            if "cancelled" not in columns:
+                # Eski dosyalar: mevcut girdiler tam üretim sayılır
+                self._conn.execute("ALTER TABLE verdicts ADD COLUMN cancelled INTEGER DEFAULT 0")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_verdicts_model ON verdicts (model, prompt_version)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key, cancel_below=None):
+        """Geçerli girdi varsa {"score", "explanation", "cancelled"} döner, yoksa None.
+
+        Yarıda kesilmiş girdi sadece skoru cancel_below'un altındaysa döner
+        (istek yine kesilecekti); tam açıklama istenen çağrıda ıskalama sayılır.
+        """
+        try:
+            with self._lock:
+                row = self._connection().execute(
+                    "SELECT score, explanation, created_at, cancelled FROM verdicts WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and self.ttl is not None and time.time() - row[2] > self.ttl:
+                    self._connection().execute("DELETE FROM verdicts WHERE key = ?", (key,))
+                    self._connection().commit()
+                    row = None
+        except sqlite3.Error as e:
+            logger.warning(f"LLM önbelleği okunamadı: {e}")
+            return None
+
+        if row is not None and row[3] and (cancel_below is None or row[0] is None or row[0] >= cancel_below):
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {"score": row[0], "explanation": row[1], "cancelled": bool(row[3])}
+
+    def put(self, key, score, explanation, model=None, prompt_version=None, cancelled=False):
+        try:
+            with self._lock:
+                self._connection().execute(
+                    "INSERT OR REPLACE INTO verdicts (key, model, prompt_version, score, explanation, created_at, "
+                    "cancelled) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, model, str(prompt_version), score, explanation, time.time(), int(cancelled)),
+                )
+                self._connection().commit()
+        except sqlite3.Error as e:
+            # Önbellek yazılamazsa karşılaştırma sonucu yine de döner
+            logger.warning(f"LLM önbelleğine yazılamadı: {e}")
+
+    def invalidate(self, model=None, prompt_version=None):
+        """Verilen model ve/veya prompt sürümüne ait girdileri sil; silinen sayısını döndür"""
+        conditions, params = [], []
+        if model is not None:
+            conditions.append("model = ?")
+            params.append(model)
+        if prompt_version is not None:
+            conditions.append("prompt_version = ?")
+            params.append(str(prompt_version))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._lock:
+            cursor = self._connection().execute(f"DELETE FROM verdicts{where}", params)
+            self._connection().commit()
+        logger.info(f"LLM önbelleğinden {cursor.rowcount} girdi silindi")
+        return cursor.rowcount
+
+    def purge_expired(self):
+        """Süresi dolmuş girdileri sil"""
+        if self.ttl is None:
+            return 0
+        with self._lock:
+            cursor = self._connection().execute(
+                "DELETE FROM verdicts WHERE created_at < ?", (time.time() - self.ttl,)
+            )
+            self._connection().commit()
+        return cursor.rowcount
+
+    def clear(self):
+        return self.invalidate()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# Süreç genelinde paylaşılan önbellek (Streamlit oturumları ve CLI için ortak)
+shared_verdict_cache = LLMVerdictCache()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kalıcı LLM karar önbelleğini yönet")
+    parser.add_argument("--path", default=DEFAULT_PATH, help="SQLite dosyası")
+    parser.add_argument("--purge-expired", action="store_true", help="Süresi dolmuş girdileri sil")
+    parser.add_argument("--invalidate-model", help="Bu modele ait girdileri sil")
+    parser.add_argument("--invalidate-prompt-version", help="Bu prompt sürümüne ait girdileri sil")
+    parser.add_argument("--clear", action="store_true", help="Tüm girdileri sil")
+    args = parser.parse_args()
+
+    cache = LLMVerdictCache(args.path)
+    if args.clear:
+        print(f"🧹 {cache.clear()} girdi silindi")
+    elif args.invalidate_model or args.invalidate_prompt_version:
+        count = cache.invalidate(args.invalidate_model, args.invalidate_prompt_version)
+        print(f"🧹 {count} girdi silindi")
+    elif args.purge_expired:
+        print(f"🧹 Süresi dolmuş {cache.purge_expired()} girdi silindi")
+    else:
+        total = cache._connection().execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+        print(f"💾 {args.path}: {total} karar saklı")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
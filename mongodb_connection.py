@@ -1,5 +1,85 @@
-from pymongo import MongoClient, errors
+from pymongo import MongoClient, DESCENDING, errors
 import logging
+import queue
+import threading
+
+_STREAM_END = object()
+
+# Ingest sırasında her kurala yazılan zaman damgası; "en son kurallar" buna göre sıralanır
+INGESTED_AT_KEY = "ingested_at"
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def shared_client(uri):
+    """URI başına süreç genelinde tek MongoClient; istekler onun bağlantı havuzunu paylaşır"""
+    with _clients_lock:
+        client = _clients.get(uri)
+        if client is None:
+            client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+            _clients[uri] = client
+        return client
+
+
+def ensure_rule_indexes(collection):
+    """Kural seçimi sorgularının (sıralama + limit) indeksten karşılanması için indeksleri oluştur"""
+    try:
+        collection.create_index([(INGESTED_AT_KEY, DESCENDING)])
+        collection.create_index([("date", DESCENDING)])
+    except errors.PyMongoError as e:
+        logging.warning("[-] Kural indeksleri oluşturulamadı: %s", str(e))
+
+
+def stream_documents(collection, query=None, projection=None, batch_size=500, prefetch=2):
+    """Cursor'ı arka plan thread'inde batch'ler halinde okuyup dokümanları tek tek döndürür.
+
+    En fazla `prefetch` batch bellekte bekler; böylece Mongo I/O'su ile tüketicideki
+    işlem örtüşür ve koleksiyon boyutundan bağımsız olarak bellek kullanımı sabit kalır.
+    """
+    batches = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            batch = []
+            for doc in collection.find(query or {}, projection, batch_size=batch_size):
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch:
+                put(batch)
+        except Exception as e:
+            put(e)
+        finally:
+            put(_STREAM_END)
+
+    producer = threading.Thread(target=produce, name="mongo-stream", daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = batches.get()
+            if item is _STREAM_END:
+                break
+            if isinstance(item, Exception):
+                raise ConnectionError(f"MongoDB'den veri alınamadı: {item}")
+            yield from item
+    finally:
+        stop.set()
+
+
 class MongoConnector:
     def __init__(self, uri: str, db_name: str, collection_name: str):
         self.uri = uri
@@ -0,0 +1,53 @@
+from collections import Counter, defaultdict
+
+NGRAM_START = "\x02"
+NGRAM_END = "\x03"
+
+
+def char_ngrams(value, n=3):
+    """Value'yu küçük harfe çevirip sınır karakterleriyle birlikte n-gram kümesine ayır"""
+    text = f"{NGRAM_START}{str(value).lower()}{NGRAM_END}"
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class NgramIndex:
+    """Corpus value'larından karakter n-gram → kural ters indeksi.
+
+    Value'lar küçük harfe çevrilip başına/sonuna sınır karakteri eklenerek
+    n-gram'lara ayrılır; böylece 1-2 karakterlik value'lar da yalnızca tam
+    veya baştan eşleşen value'larla ortak n-gram paylaşır (is_meaningful_match
+    kısa stringlerde zaten sadece bu eşleşmeleri kabul ediyor).
+    """
+
+    def __init__(self, n=3):
+        self.n = n
+        self.postings = defaultdict(set)
+        self.rule_count = 0
+
+    def ngrams(self, value):
+        return char_ngrams(value, self.n)
+
+    def add(self, rule_key, values):
+        """Bir kuralın value'larını indekse ekle"""
+        for value in set(values):
+            for gram in self.ngrams(value):
+                self.postings[gram].add(rule_key)
+        self.rule_count += 1
+
+    def candidate_hits(self, query_values):
+        """Her aday kural için, en az bir ortak n-gram paylaştığı query value sayısı.
+
+        Bu sayı value benzerliği için bir üst sınır değil, bir tahmindir: ortak
+        n-gram'ı olmayan çiftler de (ör. 'axcdxfgxijxl' / 'abcdefghijkl') kısa
+        ortak bloklardan yüksek fuzzy skor alabilir. Bu yüzden indeksle aday
+        seçimi yaklaşıktır.
+        """
+        hits = Counter()
+        for value in query_values:
+            rules = set()
+            for gram in self.ngrams(value):
+                rules.update(self.postings.get(gram, ()))
+            hits.update(rules)
+        return hits
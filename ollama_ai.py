@@ -1,12 +1,64 @@
 import yaml
 import os
-import requests
+import json
+import queue
+import asyncio
 from dotenv import load_dotenv
-from mongodb_connection import MongoConnector
+from mongodb_connection import INGESTED_AT_KEY, shared_client, ensure_rule_indexes
 import re
-import time
+from llm_cache import shared_verdict_cache, verdict_key
+from http_client import shared_http, shared_async_http, DEFAULT_CONNECT_TIMEOUT
+from result_cache import shared_result_cache
+from similarity_algorithm import SigmaRuleComparator, FEATURES_KEY
 load_dotenv()
 
+# _generate_prompt değiştiğinde artırılmalı; eski önbellek girdileri kullanılmaz
+PROMPT_VERSION = 1
+
+# Ollama sunucusuna aynı anda gönderilecek istek sayısı (sunucudaki OLLAMA_NUM_PARALLEL ile uyumlu olmalı)
+DEFAULT_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "4"))
+DEFAULT_TIMEOUT = 300  # saniye, tek bir karşılaştırma için (okuma timeout'u)
+
+# Cascade modu: LLM'e sadece yapısal olarak en yakın K kural gönderilir
+DEFAULT_CASCADE_TOP_K = 20
+DEFAULT_CASCADE_THRESHOLD = 0.3  # SigmaRuleComparator ağırlıklı skoru (0-1)
+
+# Akış modunda skorun tamamlandığından emin olmak için sayıdan sonra "/ 100", satır sonu vb. beklenir
+EARLY_SCORE_PATTERN = re.compile(r"Benzerlik Skoru[^:\n]*:\**\s*(\d{1,3})(?=\s*(?:/|\n|\*|puan))", re.IGNORECASE)
+
+# Toplu (one-vs-many) karşılaştırma: sorgu kuralı bir kez, adaylar gruplar halinde gönderilir
+DEFAULT_BATCH_SIZE = 8
+DEFAULT_CONTEXT_TOKENS = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+CHARS_PER_TOKEN = 3  # YAML için kaba tahmin; tokenizer'a erişim olmadan güvenli tarafta kalır
+BATCH_OUTPUT_TOKENS = 120  # Aday başına cevap (skor + kısa özet) için ayrılan pay
+BATCH_PROMPT_VERSION = 1
+BATCH_PROMPT_KEY = f"batch-{BATCH_PROMPT_VERSION}"  # Toplu kararlar önbellekte ayrı tutulur
+BATCH_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "candidate": {"type": "integer"},
+                    "score": {"type": "integer", "minimum": 0, "maximum": 100},
+                    "summary": {"type": "string"}
+                },
+                "required": ["candidate", "score", "summary"]
+            }
+        }
+    },
+    "required": ["results"]
+}
+
+# select_rules'un sıralayabildiği (indeksli) alanlar
+RULE_SORT_FIELDS = (INGESTED_AT_KEY, "date")
+
+def estimate_tokens(text):
+    """Metnin yaklaşık token sayısı"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
 class OllamaAI:
     def __init__(
         self,
@@ -15,45 +67,402 @@ class OllamaAI:
         collection_name="rules",
         ollama_url="http://localhost:11434/api/generate",
         ollama_model=None,
+        rule_corpus=None,
+        concurrency=DEFAULT_CONCURRENCY,
+        timeout=DEFAULT_TIMEOUT,
+        verdict_cache=shared_verdict_cache,
+        context_tokens=DEFAULT_CONTEXT_TOKENS,
     ):
         self.mongo_uri = mongo_uri or os.getenv("MONGO_URI")
         self.db_name = db_name
         self.collection_name = collection_name
         self.ollama_url = ollama_url
         self.ollama_model = ollama_model or os.getenv("OLLAMA_MODEL")
+        self.rule_corpus = rule_corpus  # Paylaşılan RuleCorpus verilirse koleksiyonu ve önbelleği kullanılır
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.verdict_cache = verdict_cache  # None verilirse her karşılaştırma modele gider
+        self.context_tokens = context_tokens  # Toplu karşılaştırmada grupların sığması gereken bağlam penceresi
+        self._comparator = None
+        self._collection = None
 
     def load_yaml(self, file_path):
         with open(file_path, 'r', encoding='utf-8') as f:
             return yaml.safe_load(f)
 
+    def rules_collection(self):
+        """Kural koleksiyonu; RuleCorpus'unki veya paylaşılan (havuzlu) MongoClient üzerinden"""
+        if self._collection is None:
+            if self.rule_corpus is not None:
+                self._collection = self.rule_corpus.collection
+            else:
+                self._collection = shared_client(self.mongo_uri)[self.db_name][self.collection_name]
+            ensure_rule_indexes(self._collection)
+        return self._collection
+
+    def select_rules(self, limit=10, sort_by=INGESTED_AT_KEY, descending=True, projection=None,
+                     logsource=None, tags=None):
+        """Kuralları sunucu tarafında filtrele, sırala ve limitle.
+
+        sort_by: ingest zamanı veya Sigma `date` alanı (ikisi de indeksli). logsource
+        {"product": "windows"} gibi bir sözlük, tags ise en az biri bulunması gereken
+        tag listesidir. projection verilmezse sadece detection feature'ları dışarıda kalır.
+        Ingest zamanı olmayan eski kurallar azalan sıralamada en sona düşer.
+        """
+        if sort_by not in RULE_SORT_FIELDS:
+            raise ValueError(f"Geçersiz sıralama alanı: {sort_by} (seçenekler: {', '.join(RULE_SORT_FIELDS)})")
+        if limit <= 0:
+            return []
+
+        query = {f"logsource.{key}": value for key, value in (logsource or {}).items() if value}
+        if tags:
+            query["tags"] = {"$in": list(tags)}
+        direction = -1 if descending else 1
+
+        cursor = (self.rules_collection()
+                  .find(query, projection if projection is not None else {FEATURES_KEY: 0})
+                  .sort([(sort_by, direction), ("_id", direction)])
+                  .limit(limit))
+        return list(cursor)
+
     def fetch_latest_rules(self, limit=10):
-        connector = MongoConnector(self.mongo_uri, self.db_name, self.collection_name)
-        collection = connector.connect()
-        rules = list(collection.find())
-        connector.close()
-        return rules[-limit:]
-
-    def compare_rules_with_ai(self, rule1, rule2):
-        prompt = self._generate_prompt(rule1, rule2)
-        response = requests.post(self.ollama_url, json={
+        """En son ingest edilen `limit` kural"""
+        return self.select_rules(limit=limit)
+
+    def structural_comparator(self):
+        """Cascade ön elemesi için SigmaRuleComparator (RuleCorpus varsa onun koleksiyonu ve önbelleği)"""
+        if self._comparator is None:
+            self._comparator = SigmaRuleComparator(self.rules_collection(), rule_corpus=self.rule_corpus,
+                                                   result_cache=shared_result_cache)
+        return self._comparator
+
+    def cascade_candidates(self, rule, top_k=DEFAULT_CASCADE_TOP_K, min_similarity=DEFAULT_CASCADE_THRESHOLD):
+        """Tüm corpus'ta rule'a yapısal olarak en yakın en fazla top_k kuralı seç.
+
+        Ağırlıklı benzerliği min_similarity altındaki kurallar elenir. (kural, eşleşme)
+        çiftleri döner; eşleşme SigmaRuleComparator sonucudur ve sıra benzerliğe göredir.
+        """
+        comparator = self.structural_comparator()
+        matches = comparator.compare_rule(rule, top_n=top_k, threshold=min_similarity)
+        rules = comparator.fetch_matched_rules(matches)
+        return [(rules[m["rule_id"]], m) for m in matches if m["rule_id"] in rules]
+
+    def _request_payload(self, rule1, rule2, stream=False):
+        return {
             "model": self.ollama_model,
-            "prompt": prompt,
-            "stream": False
-        })
-
-        response.raise_for_status()
-        full_response = response.json().get("response")
-        print(full_response)
-
-        score = self._extract_score(full_response)
+            "prompt": self._generate_prompt(rule1, rule2),
+            "stream": stream
+        }
 
+    def _build_result(self, rule1, rule2, full_response, score=None, cached=False, cancelled=False):
         return {
-            "score": score,
+            "score": self._extract_score(full_response) if score is None else score,
             "explanation": full_response,
             "rule1" : yaml.dump(rule1),
-            "rule2" : yaml.dump(rule2)
+            "rule2" : yaml.dump(rule2),
+            "cached": cached,
+            "cancelled": cancelled  # Skor eşiğin altında kaldığı için üretim yarıda kesildi
         }
 
+    def _stream_step(self, text, line, on_token, cancel_below):
+        """Ollama akışının bir NDJSON satırını işle; (metin, bitti mi, erken skor) döner.
+
+        Erken skor sadece cancel_below'un altındaysa döner; çağıran bu durumda
+        bağlantıyı kapatır ve Ollama üretimi durdurur.
+        """
+        if not line.strip():
+            return text, False, None
+        chunk = json.loads(line)
+        text += chunk.get("response", "")
+        if on_token is not None:
+            on_token(text)
+        if cancel_below is not None:
+            match = EARLY_SCORE_PATTERN.search(text)
+            if match and int(match.group(1)) < cancel_below:
+                return text, True, int(match.group(1))
+        return text, chunk.get("done", False), None
+
+    def _cache_key(self, rule1, rule2, prompt_version=PROMPT_VERSION):
+        return verdict_key(rule1, rule2, self.ollama_model, prompt_version)
+
+    def _cached_result(self, rule1, rule2, prompt_version=PROMPT_VERSION, cancel_below=None):
+        """Önbellekte karar varsa sonucu döndür (model çağrılmaz), yoksa None.
+
+        Yarıda kesilmiş kararlar sadece cancel_below ile yine kesilecek isteklere döner.
+        """
+        if self.verdict_cache is None:
+            return None
+        verdict = self.verdict_cache.get(self._cache_key(rule1, rule2, prompt_version), cancel_below)
+        if verdict is None:
+            return None
+        return self._build_result(rule1, rule2, verdict["explanation"], score=verdict["score"], cached=True,
+                                  cancelled=verdict["cancelled"])
+
+    def _store_result(self, rule1, rule2, result, prompt_version=PROMPT_VERSION):
+        # Boş yanıtlar saklanmaz; bir sonraki denemede model tekrar çağrılır
+        if self.verdict_cache is not None and result["explanation"]:
+            self.verdict_cache.put(self._cache_key(rule1, rule2, prompt_version), result["score"],
+                                   result["explanation"], model=self.ollama_model, prompt_version=prompt_version,
+                                   cancelled=result["cancelled"])
+        return result
+
+    def compare_rules_with_ai(self, rule1, rule2, on_token=None, cancel_below=None):
+        """İki kuralı Ollama ile karşılaştır.
+
+        on_token veya cancel_below verilirse yanıt akış (stream) olarak okunur:
+        on_token her parçada o ana kadarki metinle çağrılır, skor cancel_below'un
+        altında çıkarsa üretim iptal edilir.
+        """
+        cached = self._cached_result(rule1, rule2, cancel_below=cancel_below)
+        if cached is not None:
+            return cached
+
+        stream = on_token is not None or cancel_below is not None
+        # Üretimin yan etkisi yok; 429/5xx'te tekrar denenebilir
+        response = shared_http.post(self.ollama_url, json=self._request_payload(rule1, rule2, stream), stream=stream,
+                                    timeout=(DEFAULT_CONNECT_TIMEOUT, self.timeout), idempotent=True)
+
+        if not stream:
+            response.raise_for_status()
+            full_response = response.json().get("response")
+            print(full_response)
+            return self._store_result(rule1, rule2, self._build_result(rule1, rule2, full_response))
+
+        text, early_score = "", None
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                text, done, early_score = self._stream_step(text, line, on_token, cancel_below)
+                if done:
+                    break
+        return self._store_result(rule1, rule2, self._build_result(rule1, rule2, text, score=early_score,
+                                                                   cancelled=early_score is not None))
+
+    async def _post_async(self, payload, read):
+        """Ollama'ya paylaşılan async istemciyle POST; üretim yan etkisiz olduğu için 429/5xx'te tekrar denenir"""
+        return await shared_async_http.request("POST", self.ollama_url, read, json=payload, idempotent=True,
+                                               timeout=(DEFAULT_CONNECT_TIMEOUT, self.timeout))
+
+    async def compare_rules_with_ai_async(self, rule1, rule2, on_token=None, cancel_below=None):
+        """compare_rules_with_ai'nin asyncio karşılığı (paylaşılan AsyncHTTPClient loop'unda çalışır)"""
+        cached = self._cached_result(rule1, rule2, cancel_below=cancel_below)
+        if cached is not None:
+            return cached
+
+        stream = on_token is not None or cancel_below is not None
+
+        async def read(response):
+            response.raise_for_status()
+            if not stream:
+                data = await response.json()
+                return self._build_result(rule1, rule2, data.get("response") or "")
+
+            text, early_score = "", None
+            async for line in response.content:
+                text, done, early_score = self._stream_step(text, line, on_token, cancel_below)
+                if done:
+                    break
+            if early_score is not None:
+                # Bağlantı kapanınca Ollama bu isteğin üretimini durdurur
+                response.close()
+            return self._build_result(rule1, rule2, text, score=early_score, cancelled=early_score is not None)
+
+        result = await self._post_async(self._request_payload(rule1, rule2, stream), read)
+        return self._store_result(rule1, rule2, result)
+
+    async def _as_completed(self, coroutines):
+        """Coroutine'leri birlikte çalıştır, sonuçlarını tamamlanma sırasıyla döndür.
+
+        Tüketici erken çıkarsa bekleyen istekler iptal edilir.
+        """
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def compare_many_async(self, rule1, rules, on_token=None, cancel_below=None):
+        """rule1'i tüm kurallarla eşzamanlı karşılaştır; sonuçları tamamlanma sırasıyla döndür.
+
+        En fazla `concurrency` istek aynı anda sunucudadır. Her eleman
+        (sıra no, kural, sonuç, hata) şeklindedir; hata olursa sonuç None olur.
+        on_token verilirse (sıra no, metin) ile çağrılır; cancel_below için
+        compare_rules_with_ai'ye bakınız.
+        """
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+
+        async def run(idx, rule):
+            async with semaphore:
+                try:
+                    token_callback = (lambda text: on_token(idx, text)) if on_token is not None else None
+                    result = await self.compare_rules_with_ai_async(rule1, rule, token_callback, cancel_below)
+                    return idx, rule, result, None
+                except Exception as e:
+                    return idx, rule, None, e
+
+        async for item in self._as_completed(run(idx, rule) for idx, rule in enumerate(rules, start=1)):
+            yield item
+
+    def _iterate(self, results, tokens=None, on_token=None):
+        """Async generator'ı paylaşılan HTTP loop'unda adım adım çalıştırıp senkron olarak yield et.
+
+        tokens kuyruğuna loop thread'inde biriken (sıra no, metin) çağrıları
+        beklerken çağıranın thread'inde on_token'a aktarılır.
+        """
+        done = object()
+
+        async def step():
+            try:
+                return await results.__anext__()
+            except StopAsyncIteration:
+                return done
+
+        try:
+            while True:
+                future = shared_async_http.run(step())
+                while tokens is not None:
+                    try:
+                        on_token(*tokens.get(timeout=0.05))
+                    except queue.Empty:
+                        if future.done():
+                            break
+                while tokens is not None and not tokens.empty():
+                    on_token(*tokens.get_nowait())
+                item = future.result()
+                if item is done:
+                    break
+                yield item
+        finally:
+            shared_async_http.run(results.aclose()).result()
+
+    def compare_many(self, rule1, rules, on_token=None, cancel_below=None):
+        """compare_many_async'in senkron sarmalayıcısı (Streamlit ve CLI için).
+
+        Paylaşılan HTTP istemcisinin loop'unda çalışır ve her sonuç tamamlandığında
+        hemen yield eder, böylece çağıran taraf sonuçları geldikçe gösterebilir.
+        on_token çağıranın thread'inde çalışır (Streamlit öğeleri güncellenebilir).
+        """
+        if on_token is None:
+            return self._iterate(self.compare_many_async(rule1, rules, None, cancel_below))
+        tokens = queue.SimpleQueue()
+        relay = lambda idx, text: tokens.put((idx, text))
+        return self._iterate(self.compare_many_async(rule1, rules, relay, cancel_below), tokens, on_token)
+
+    def split_batches(self, rule1, rules, batch_size=DEFAULT_BATCH_SIZE):
+        """(sıra no, kural) çiftlerini hem batch_size'a hem modelin bağlam penceresine sığacak gruplara böl.
+
+        Her aday, YAML'ının tahmini token sayısı artı cevabı için ayrılan pay kadar
+        yer tutar. Tek başına pencereye sığmayan aday kendi grubunda gönderilir.
+        """
+        base = estimate_tokens(self._generate_batch_prompt(rule1, []))
+        batches, current, used = [], [], base
+        for idx, rule in rules:
+            cost = estimate_tokens(yaml.dump(rule)) + BATCH_OUTPUT_TOKENS
+            if current and (len(current) >= batch_size or used + cost > self.context_tokens):
+                batches.append(current)
+                current, used = [], base
+            current.append((idx, rule))
+            used += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    def _batch_payload(self, rule1, batch):
+        return {
+            "model": self.ollama_model,
+            "prompt": self._generate_batch_prompt(rule1, [rule for _, rule in batch]),
+            "format": BATCH_RESPONSE_SCHEMA,
+            "stream": False,
+            "options": {"num_ctx": self.context_tokens}
+        }
+
+    def _parse_batch_response(self, rule1, batch, text):
+        """Modelin JSON cevabını (sıra no, kural, sonuç, hata) listesine çevir; regex kullanılmaz"""
+        verdicts = {}
+        for item in json.loads(text).get("results", []):
+            if isinstance(item, dict) and isinstance(item.get("candidate"), int):
+                verdicts[item["candidate"]] = item
+
+        items = []
+        for position, (idx, rule) in enumerate(batch, start=1):
+            verdict = verdicts.get(position)
+            if verdict is None:
+                items.append((idx, rule, None, ValueError("Model bu aday için sonuç döndürmedi")))
+                continue
+            score = min(max(int(verdict.get("score", 0)), 0), 100)
+            result = self._build_result(rule1, rule, str(verdict.get("summary", "")), score=score)
+            items.append((idx, rule, self._store_result(rule1, rule, result, BATCH_PROMPT_KEY), None))
+        return items
+
+    async def compare_batch_async(self, rule1, batch):
+        """Sorgu kuralını bir grup adayla tek istekte karşılaştır (Ollama JSON `format` çıktısı)"""
+        async def read(response):
+            response.raise_for_status()
+            return (await response.json()).get("response") or ""
+
+        return self._parse_batch_response(rule1, batch, await self._post_async(self._batch_payload(rule1, batch), read))
+
+    async def compare_many_batched_async(self, rule1, rules, batch_size=DEFAULT_BATCH_SIZE):
+        """compare_many_async gibi, ama adaylar gruplar halinde tek istekte karşılaştırılır.
+
+        Önbellekte kararı olan adaylar hemen döner; kalanlar split_batches ile
+        bölünür ve gruplar `concurrency` sınırıyla eşzamanlı gönderilir.
+        """
+        pending = []
+        for idx, rule in enumerate(rules, start=1):
+            cached = self._cached_result(rule1, rule, BATCH_PROMPT_KEY)
+            if cached is not None:
+                yield idx, rule, cached, None
+            else:
+                pending.append((idx, rule))
+
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+
+        async def run(batch):
+            async with semaphore:
+                try:
+                    return await self.compare_batch_async(rule1, batch)
+                except Exception as e:
+                    return [(idx, rule, None, e) for idx, rule in batch]
+
+        batches = self.split_batches(rule1, pending, batch_size)
+        async for items in self._as_completed(run(batch) for batch in batches):
+            for item in items:
+                yield item
+
+    def compare_many_batched(self, rule1, rules, batch_size=DEFAULT_BATCH_SIZE):
+        """compare_many_batched_async'in senkron sarmalayıcısı; sonuçlar her grup tamamlandıkça gelir"""
+        return self._iterate(self.compare_many_batched_async(rule1, rules, batch_size))
+
+    def _generate_batch_prompt(self, rule1, candidates):
+        candidate_blocks = "\n".join(
+            f"### Aday {position}:\n{yaml.dump(rule)}" for position, rule in enumerate(candidates, start=1)
+        )
+        return f"""Sen bir siber güvenlik uzmanısın. Aşağıda bir sorgu Sigma kuralı ve onunla karşılaştırılacak {len(candidates)} aday kural veriliyor.
+
+Her aday için sorgu kuralıyla teknik benzerliğini değerlendir:
+   - Aynı logsource (örn. sysmon, zeek, powershell)
+   - Aynı veya benzer MITRE ATT&CK teknikleri/taktikleri (örn. T1047, TA0006)
+   - Aynı servisler veya modüller (örn. WMI, SMB, Kerberos, PowerShell)
+   - Benzer EventID, path, process, image, signature, detection pattern
+   - Farklı teknikler, farklı detection mantıkları, farklı log kaynakları
+
+Her aday için:
+- `candidate`: adayın numarası
+- `score`: 0 ile 100 arasında teknik benzerlik skoru
+- `summary`: ortak noktaları ve farkları özetleyen 1-3 cümlelik Türkçe açıklama
+
+Cevabı sadece JSON olarak ver, her aday için `results` listesinde bir eleman olsun.
+
+### Sorgu Kuralı:
+{yaml.dump(rule1)}
+
+{candidate_blocks}
+"""
+
     def _generate_prompt(self, rule1, rule2):
         return f"""Sen bir siber güvenlik uzmanısın. Aşağıda iki farklı Sigma kuralı veriliyor. Görevin şu:
 
@@ -145,9 +554,12 @@ def main():
 
     print(f"\nMongoDB'den {len(rules_from_mongo)} kural alındı. Skoru {THRESHOLD_SCORE} üzerindekiler açıklanacak.\n")
 
-    for idx, rule in enumerate(rules_from_mongo, start=1):
+    # İstekler eşzamanlı gider, sonuçlar tamamlandıkça yazdırılır
+    # Eşik altı skorlar açıklanmadığı için bu üretimler skor çıktığı anda durdurulur
+    for idx, rule, result, error in ai.compare_many(rule_from_file, rules_from_mongo, cancel_below=THRESHOLD_SCORE):
         try:
-            result = ai.compare_rules_with_ai(rule_from_file, rule)
+            if error is not None:
+                raise error
             score = result["score"]
 
             if score is None or score == 0:
@@ -162,8 +574,6 @@ def main():
             else:
                 print(f"⏭️  Kural #{idx} skoru {score}, eşik değerin altında ({THRESHOLD_SCORE}), atlandı.\n")
 
-            time.sleep(1)
-            
         except Exception as e:
             print(f"❌ Kural #{idx} işlenirken hata: {e}")
             continue
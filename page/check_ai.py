@@ -4,7 +4,8 @@ import streamlit as st
 import tempfile
 import os
 import time
-from ollama_ai import OllamaAI
+from ollama_ai import OllamaAI, DEFAULT_CASCADE_TOP_K, DEFAULT_CASCADE_THRESHOLD
+from rule_corpus import get_rule_corpus
 
 # Ana çalışma fonksiyonu (başka yerden çağırılabilir)
 def run_ai_checker():
@@ -51,7 +52,6 @@ def run_ai_checker():
     st.title("AI Checker")
 
     THRESHOLD_SCORE = 50
-    ai = OllamaAI()
 
     uploaded_file = st.file_uploader("🔼 Karşılaştırmak istediğiniz Sigma YAML dosyasını yükleyin", type=["yaml", "yml"])
 
@@ -62,27 +62,93 @@ def run_ai_checker():
 
         st.success("✅ YAML dosyası başarıyla yüklendi.")
 
+        selection = st.radio("🎯 LLM'e gönderilecek kurallar",
+                             ["Yapısal ön eleme (tüm corpus)", "Son eklenen 50 kural"], horizontal=True)
+        cascade = selection.startswith("Yapısal")
+        if cascade:
+            col1, col2 = st.columns(2)
+            top_k = col1.number_input("Aday sayısı (K)", min_value=1, max_value=200, value=DEFAULT_CASCADE_TOP_K,
+                                      help="Yapısal benzerliğe göre en yakın K kural AI ile karşılaştırılır")
+            min_similarity = col2.slider("Minimum yapısal benzerlik", 0.0, 1.0, DEFAULT_CASCADE_THRESHOLD, 0.05)
+
+        batched = st.checkbox("📦 Toplu karşılaştırma", value=False,
+                              help="Yüklenen kural bir kez, adaylar gruplar halinde gönderilir; her aday için skor ve kısa özet döner")
+        streaming = st.checkbox("⚡ Akış modu", value=True, disabled=batched,
+                                help="AI yanıtları üretilirken gösterilir; skor eşiğin altında çıkarsa üretim erken durdurulur")
+        use_cache = st.checkbox("💾 Önceki AI kararlarını kullan (önbellek)", value=True,
+                                help="Aynı kural çifti daha önce aynı modelle karşılaştırıldıysa model tekrar çağrılmaz")
+
         if st.button("🚀 Karşılaştırmayı Başlat"):
             with st.spinner("🧠 AI destekli karşılaştırma yapılıyor..."):
                 try:
+                    # Koleksiyon ve corpus süreç genelindeki RuleCorpus'tan gelir, her tıklamada yeni bağlantı açılmaz
+                    ai = OllamaAI(rule_corpus=get_rule_corpus())
+                    if not use_cache:
+                        ai.verdict_cache = None
                     rule_from_file = ai.load_yaml(tmp_path)
-                    rules = ai.fetch_latest_rules(limit=50)
+                    # Cascade: önce tüm corpus yapısal olarak taranır, LLM'e sadece en yakın adaylar gider
+                    structural = {}
+                    if cascade:
+                        candidates = ai.cascade_candidates(rule_from_file, top_k=int(top_k), min_similarity=min_similarity)
+                        rules = [rule for rule, _ in candidates]
+                        structural = {str(rule["_id"]): match["weighted_similarity"] for rule, match in candidates}
+                        st.info(f"🔎 Yapısal ön eleme: {len(rules)} aday kural AI ile karşılaştırılacak.")
+                    else:
+                        rules = ai.fetch_latest_rules(limit=50)
 
                     benzer_kurallar = []
 
                     st.markdown("---")
                     st.subheader("📊 Karşılaştırma Sonuçları")
 
-                    for idx, rule in enumerate(rules, 1):
-                        result = ai.compare_rules_with_ai(rule_from_file, rule)
-                        score = result["score"]
+                    progress = st.progress(0.0, text=f"0/{len(rules)} kural karşılaştırıldı")
+
+                    # Akış modunda devam eden üretimler bu alanda canlı gösterilir
+                    live_area = st.container()
+                    live = {}
+                    titles = {idx: rule.get("title", f"Kural #{idx}") for idx, rule in enumerate(rules, 1)}
+
+                    def show_tokens(idx, text):
+                        placeholder, last_update = live.get(idx, (None, 0.0))
+                        if placeholder is None:
+                            placeholder = live_area.empty()
+                        # Her token'da yeniden çizmek sayfayı yavaşlatır; en fazla saniyede ~5 güncelleme
+                        if time.monotonic() - last_update >= 0.2:
+                            placeholder.info(f"⏳ **{titles[idx]}**\n\n{text[-800:]}")
+                            last_update = time.monotonic()
+                        live[idx] = (placeholder, last_update)
+
+                    # İstekler eşzamanlı gönderilir; her sonuç tamamlandığı anda gösterilir
+                    if batched:
+                        comparisons = ai.compare_many_batched(rule_from_file, rules)
+                    else:
+                        comparisons = ai.compare_many(rule_from_file, rules,
+                                                      on_token=show_tokens if streaming else None,
+                                                      cancel_below=THRESHOLD_SCORE if streaming else None)
+                    for done, (idx, rule, result, error) in enumerate(comparisons, 1):
+                        progress.progress(done / len(rules), text=f"{done}/{len(rules)} kural karşılaştırıldı")
+                        if idx in live:
+                            live.pop(idx)[0].empty()
                         title = rule.get("title", f"Kural #{idx}")
 
+                        if error is not None:
+                            st.markdown(f"**{idx}. Kural:** `{title}`")
+                            st.error(f"❌ Karşılaştırma başarısız: {error}")
+                            st.markdown("---")
+                            continue
+
+                        score = result["score"]
+
                         if score >= THRESHOLD_SCORE:
                             benzer_kurallar.append((score, title, result["explanation"]))
 
                         st.markdown(f"**{idx}. Kural:** `{title}`")
-                        st.markdown(f"- 🔺 **Benzerlik Skoru:** `{score}/100`")
+                        cache_note = " _(önbellekten)_" if result.get("cached") else ""
+                        st.markdown(f"- 🔺 **Benzerlik Skoru:** `{score}/100`{cache_note}")
+                        if result.get("cancelled"):
+                            st.markdown("- ⏹️ Skor eşiğin altında, AI yanıtı erken durduruldu")
+                        if str(rule.get("_id")) in structural:
+                            st.markdown(f"- 🧩 **Yapısal Benzerlik:** `{structural[str(rule.get('_id'))]:.1%}`")
 
                         if score >= THRESHOLD_SCORE:
                             st.markdown("**🧠 AI Açıklaması:**")
@@ -91,12 +157,13 @@ def run_ai_checker():
                             st.code(result["rule2"], language="yaml")
 
                         st.markdown("---")
-                        time.sleep(0.5)
 
                     if not benzer_kurallar:
                         st.warning("⚠️ 50 puanın üzerinde benzer kural bulunamadı.")
                     else:
                         st.success(f"✅ Toplam {len(benzer_kurallar)} benzer kural bulundu.")
+                        for score, title, _ in sorted(benzer_kurallar, key=lambda x: x[0], reverse=True):
+                            st.markdown(f"- `{title}`: **{score}/100**")
 
                 except Exception as e:
                     st.error(f"❌ Hata oluştu: {e}")
\ No newline at end of file
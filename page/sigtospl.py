@@ -3,7 +3,7 @@ from sigma.rule import SigmaRule
 from sigma.collection import SigmaCollection
 from sigma.backends.splunk import SplunkBackend
 import yaml
-import requests
+from http_client import shared_http
 from datetime import datetime
 
 def send_to_n8n_and_save(sigma_rule_text):
@@ -20,7 +20,7 @@ def send_to_n8n_and_save(sigma_rule_text):
     }
 
     try:
-        response = requests.post(webhook_url, json=payload, timeout=10)
+        response = shared_http.post(webhook_url, json=payload, timeout=10)
         response.raise_for_status()
         result = response.json()
 
@@ -37,7 +37,7 @@ def send_to_n8n_and_save(sigma_rule_text):
             "source": "n8n_webhook"
         }
 
-        system_response = requests.post(receive_api_url, json=second_payload, timeout=10)
+        system_response = shared_http.post(receive_api_url, json=second_payload, timeout=10)
         system_response.raise_for_status()
 
         if converted_query:
@@ -50,7 +50,7 @@ def send_to_n8n_and_save(sigma_rule_text):
 
 def get_latest_data():
     try:
-        response = requests.get("http://localhost:5000/latest", timeout=5)
+        response = shared_http.get("http://localhost:5000/latest", timeout=5)
         response.raise_for_status()
         return response.text
     except Exception as e:
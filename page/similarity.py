@@ -1,7 +1,8 @@
 import streamlit as st
 import tempfile
 import time
-from mongodb_connection import MongoConnector
+from rule_corpus import get_rule_corpus
+from result_cache import shared_result_cache
 from similarity_algorithm import SigmaRuleComparator
 from dotenv import load_dotenv
 import os
@@ -19,6 +20,24 @@ def run_streamlit_sigma_ui(mongo_url="mongodb+srv://emircandemirci:m#n#m#n1135@c
     st.markdown("📝 Alternatif olarak YAML içeriğini aşağıya yapıştırabilirsiniz:")
     yaml_text_input = st.text_area("YAML İçeriği", height=250)
 
+    scoring_mode = st.radio(
+        "⚙️ Skorlama modu",
+        ["exact", "indexed", "vector"],
+        horizontal=True,
+        help="exact: tüm kurallar skorlanır. indexed: query ile ortak n-gram'ı az olan kurallar önceden elenir "
+             "(yaklaşık; kısa ortak parçalardan gelen eşleşmeler kaçabilir). "
+             "vector: TF-IDF n-gram vektörleriyle toplu (yaklaşık) skorlama.",
+    )
+
+    restrict_partition = st.checkbox(
+        "🧭 Sadece uyumlu logsource / ortak ATT&CK tekniği olan kuralları tara",
+        help="Kapalıyken uyumlu kurallar önce, kalanlar sonra taranır; açıkken diğer kurallar hiç skorlanmaz.",
+    )
+    tag_weight = st.slider("🎯 ATT&CK tag ağırlığı", 0.0, 0.5, 0.0, 0.05,
+                           help="Tag örtüşmesinin toplam benzerlikteki payı (0: sadece detection).")
+    show_stats = st.checkbox("⏱️ Aşama sürelerini göster")
+    profile_query = st.checkbox("🔬 cProfile ile profille", help="Sorgu yavaşlar; sadece tanılama için açın.")
+
     file_provided = uploaded_file is not None
     text_provided = yaml_text_input.strip() != ""
 
@@ -38,11 +57,27 @@ def run_streamlit_sigma_ui(mongo_url="mongodb+srv://emircandemirci:m#n#m#n1135@c
     if tmp_path and st.button("🚀 Karşılaştırmayı Başlat"):
         with st.spinner("🧠 Karşılaştırma yapılıyor..."):
             try:
-                connector = MongoConnector(mongo_url, db_name, collection_name)
-                collection = connector.connect()
-                comparator = SigmaRuleComparator(collection)
+                # Kurallar ve feature'ları süreç boyunca bir kez yüklenir, tüm oturumlar paylaşır
+                rule_corpus = get_rule_corpus(mongo_url, db_name, collection_name)
+                comparator = SigmaRuleComparator(rule_corpus.collection, mode=scoring_mode,
+                                                 restrict_partition=restrict_partition, tag_weight=tag_weight,
+                                                 rule_corpus=rule_corpus, result_cache=shared_result_cache,
+                                                 profile=profile_query)
                 results = comparator.compare_with_mongodb(tmp_path, top_n=10)
 
+                if show_stats or profile_query:
+                    stats = comparator.last_stats
+                    with st.expander(f"⏱️ Aşama süreleri (toplam {stats.total * 1000:.0f} ms)", expanded=True):
+                        st.table([
+                            {"Aşama": label, "Süre (ms)": f"{ms:.1f}", "Pay": f"{share:.1%}"}
+                            for label, ms, share in stats.rows()
+                        ])
+                        st.table([
+                            {"Sayaç": label, "Değer": value} for label, value in stats.counter_rows()
+                        ])
+                        if stats.profile:
+                            st.code(stats.profile)
+
                 if not results:
                     st.warning("⚠️ 50 puanın üzerinde benzer kural bulunamadı.")
                 else:
@@ -55,10 +90,20 @@ def run_streamlit_sigma_ui(mongo_url="mongodb+srv://emircandemirci:m#n#m#n1135@c
                         st.markdown(f"- 📊 Toplam Benzerlik: `{match['weighted_similarity']:.1%}`")
                         st.markdown(f"- 🔤 Value Benzerliği: `{match['value_similarity']:.1%}`")
                         st.markdown(f"- 🏷️ Field Benzerliği: `{match['field_similarity']:.1%}`")
+                        st.markdown(f"- 🎯 ATT&CK Tag Benzerliği: `{match['tag_similarity']:.1%}`")
 
                         with st.expander("📂 Detaylar"):
                             st.code(f"Fields: {match['mongo_fields']}")
                             st.code(f"Values: {match['mongo_values'][:5]}...")
+                            explanations = match.get('explanations', {})
+                            st.markdown(f"**Ortak field'lar:** `{', '.join(explanations.get('matched_fields', [])) or '-'}`")
+                            value_matches = [m for m in explanations.get('value_matches', []) if m['best_match']]
+                            if value_matches:
+                                st.markdown("**🎯 En İyi Value Eşleşmeleri:**")
+                                st.table([
+                                    {"YAML": m['query_value'], "Kural": m['best_match'], "Skor": f"{m['score']:.1%}"}
+                                    for m in value_matches
+                                ])
                             if 'full_rule' in match:
                                 st.code(match['full_rule'], language="yaml")
 
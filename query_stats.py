@@ -0,0 +1,130 @@
+import io
+import time
+import pstats
+import cProfile
+from collections import Counter
+from contextlib import contextmanager
+
+# Aşamaların arayüz/CLI'da gösterilen adları (sıra raporlama sırasıdır)
+STAGE_LABELS = {
+    "yaml_parse": "YAML okuma",
+    "query_features": "Query feature çıkarımı",
+    "cache_lookup": "Sonuç önbelleği",
+    "corpus_prepare": "Corpus / indeks hazırlığı",
+    "candidate_selection": "Aday seçimi (indeks / vektör)",
+    "mongo_fetch": "MongoDB okuma",
+    "rule_features": "Kural feature çıkarımı",
+    "value_scoring": "Value skorlama",
+    "parallel_scoring": "Paralel skorlama",
+    "ranking": "Sıralama (top-N)",
+    "full_rule_fetch": "Tam kural getirme",
+    "yaml_dump": "YAML render",
+}
+
+COUNTER_LABELS = {
+    "rules_scanned": "Taranan kural",
+    "rules_scored": "Skorlanan kural",
+    "rules_pruned": "Budanan kural (üst sınır)",
+    "pairs_compared": "Karşılaştırılan value çifti",
+    "pairs_scored": "Hesaplanan farklı çift",
+    "pairs_pruned": "Budanan value çifti",
+    "cache_hit": "Önbellekten dönen",
+}
+
+PROFILE_TOP = 25
+
+
+class QueryStats:
+    """Tek bir benzerlik sorgusunun aşama süreleri ve sayaçları"""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = Counter()
+        self.profile = None
+        self._started = time.perf_counter()
+        self.total = 0.0
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def timed(self, iterable, name):
+        """Iterable'dan her elemanın gelmesini bekleme süresini `name` aşamasına yaz"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start)
+                return
+            self.add_time(name, time.perf_counter() - start)
+            yield item
+
+    def finish(self):
+        self.total = time.perf_counter() - self._started
+        return self
+
+    def as_dict(self):
+        ordered = sorted(self.stages, key=lambda s: list(STAGE_LABELS).index(s) if s in STAGE_LABELS else len(STAGE_LABELS))
+        return {
+            "total_ms": self.total * 1000,
+            "stages_ms": {name: self.stages[name] * 1000 for name in ordered},
+            "counters": dict(self.counters),
+            "profile": self.profile,
+        }
+
+    def rows(self):
+        """(aşama, ms, yüzde) satırları; sayfa ve CLI tablosu için"""
+        total = self.total or sum(self.stages.values()) or 1.0
+        return [
+            (STAGE_LABELS.get(name, name), ms, ms / 1000 / total)
+            for name, ms in self.as_dict()["stages_ms"].items()
+        ]
+
+    def counter_rows(self):
+        """(sayaç, değer) satırları, COUNTER_LABELS sırasıyla"""
+        order = list(COUNTER_LABELS)
+        names = sorted(self.counters, key=lambda c: order.index(c) if c in order else len(order))
+        return [(COUNTER_LABELS.get(name, name), self.counters[name]) for name in names]
+
+    def format(self):
+        lines = [f"⏱️ Toplam süre: {self.total * 1000:.1f} ms"]
+        for label, ms, share in self.rows():
+            lines.append(f"   {label:<32} {ms:10.1f} ms  {share:6.1%}")
+        for label, value in self.counter_rows():
+            lines.append(f"   {label:<32} {value:>10}")
+        return "\n".join(lines)
+
+
+class QueryProfiler:
+    """İsteğe bağlı cProfile sarmalayıcısı; sonuç en pahalı fonksiyonların metin özetidir"""
+
+    def __init__(self, enabled=False, top=PROFILE_TOP):
+        self.enabled = enabled
+        self.top = top
+        self._profile = cProfile.Profile() if enabled else None
+
+    def __enter__(self):
+        if self._profile is not None:
+            self._profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self._profile is not None:
+            self._profile.disable()
+        return False
+
+    def report(self):
+        if self._profile is None:
+            return None
+        output = io.StringIO()
+        pstats.Stats(self._profile, stream=output).sort_stats("cumulative").print_stats(self.top)
+        return output.getvalue()
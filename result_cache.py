@@ -0,0 +1,81 @@
+import copy
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL_SECONDS = 15 * 60
+
+
+def corpus_identity(collection):
+    """Koleksiyonu sunucu, veritabanı ve koleksiyon adıyla tanımlayan string.
+
+    Aynı önbelleği paylaşan farklı corpus'ların (ör. farklı MONGO_URI'ler)
+    sonuçları birbirine karışmasın diye fingerprint'e eklenir.
+    """
+    if collection is None:
+        return None
+    return f"{collection.database.client!r}/{collection.full_name}"
+
+
+def query_fingerprint(yaml_fields, yaml_values, partition, yaml_tags, **params):
+    """Query'nin normalize detection bileşenleri ve skorlama parametrelerinden hash üret.
+
+    Başlık, açıklama, tarih gibi skora etki etmeyen alanlar hash'e girmez; böylece
+    sadece bu alanları değiştirilerek tekrar yüklenen kural önbellekten döner.
+    """
+    payload = {
+        "fields": sorted(yaml_fields),
+        "values": sorted(yaml_values),
+        "logsource": partition["logsource"],
+        "techniques": sorted(partition["techniques"]),
+        "tags": sorted(yaml_tags),
+        "params": params,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Benzerlik sonuçları için sınırlı boyutlu LRU + TTL önbellek.
+
+    Her girdi üretildiği corpus sürümüyle saklanır; sürümü tutmayan girdi
+    (RuleCorpus.invalidate sonrası) ıskalama sayılıp silinir. Farklı corpus'lar
+    anahtardaki corpus_identity ile ayrışır, birinin sürümü diğerini etkilemez.
+    Sonuçlar kopyalanarak saklanır ve döndürülür; çağıranın değişiklikleri önbelleği bozmaz.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != version or time.monotonic() - entry[0] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[2])
+
+    def put(self, key, results, version=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), version, copy.deepcopy(results))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Süreç genelinde paylaşılan önbellek (Streamlit oturumları arasında ortak)
+shared_result_cache = ResultCache()
@@ -0,0 +1,118 @@
+import os
+import logging
+import threading
+
+import bson
+from pymongo import errors
+
+from mongodb_connection import MongoConnector
+from similarity_algorithm import SigmaRuleComparator, SCORING_PROJECTION, rule_stub
+from rule_features import RuleFeatures, ValueDictionary
+
+logger = logging.getLogger(__name__)
+
+# Bellekteki corpus için üst sınır (MB; doküman özetleri, value id'leri ve value sözlüğü üzerinden yaklaşık)
+DEFAULT_MAX_MB = int(os.getenv("RULE_CORPUS_MAX_MB", "512"))
+
+
+class RuleCorpus:
+    """Kuralları ve feature'larını süreç boyunca bir kez yükleyip paylaşan sıcak önbellek.
+
+    Bellekte dokümanların yalnızca skorlama ve sonuç için gereken özeti
+    (_id, title, logsource, tags) tutulur; tam kural sonuçlar için Mongo'dan
+    getirilir. Value'lar snapshot'a özel bir ValueDictionary'de saklanır.
+
+    Streamlit'te modüller süreç başına bir kez import edildiği için aynı nesne
+    tüm oturum ve sayfalar tarafından kullanılır. Koleksiyon değiştiğinde
+    invalidate() ile (veya destekleniyorsa Mongo change stream'i ile otomatik)
+    sürüm artar ve bir sonraki snapshot() corpus'u yeniden yükler. Corpus
+    max_mb'yi aşarsa önbelleğe alınmaz; snapshot() None döner ve çağıran
+    taraf akış haline (streaming) geri düşer.
+    """
+
+    def __init__(self, collection, max_mb=DEFAULT_MAX_MB, watch_changes=True, connector=None):
+        self.collection = collection
+        self.connector = connector
+        self.max_bytes = max_mb * 1024 * 1024
+        self.version = 0
+        self.over_capacity = False
+        self._snapshot = None
+        self._lock = threading.RLock()
+        self._comparator = SigmaRuleComparator(None)
+        self._watcher = None
+        if watch_changes:
+            self._start_watcher()
+
+    def _start_watcher(self):
+        def watch():
+            try:
+                with self.collection.watch() as stream:
+                    for _ in stream:
+                        self.invalidate()
+            except errors.PyMongoError as e:
+                # Standalone sunucularda change stream yok; invalidate() elle çağrılmalı
+                logger.info(f"Change stream kullanılamıyor, corpus sadece elle yenilenecek: {e}")
+            except Exception as e:
+                logger.warning(f"Change stream durdu: {e}")
+
+        self._watcher = threading.Thread(target=watch, name="rule-corpus-watch", daemon=True)
+        self._watcher.start()
+
+    def invalidate(self):
+        """Corpus'u geçersiz kıl; bir sonraki snapshot() yeniden yükler"""
+        with self._lock:
+            self.version += 1
+            self._snapshot = None
+            self.over_capacity = False
+        logger.info(f"Rule corpus geçersiz kılındı (sürüm {self.version})")
+
+    def load(self):
+        """Koleksiyonu feature'larıyla birlikte belleğe al; bellek sınırı aşılırsa None"""
+        documents, features = [], []
+        dictionary = ValueDictionary()
+        size = 0
+        try:
+            for doc in self.collection.find({}, SCORING_PROJECTION, batch_size=500):
+                stub = rule_stub(doc)
+                rule_features = RuleFeatures(*self._comparator.get_rule_features(doc), dictionary)
+                size += len(bson.encode(stub)) + rule_features.nbytes
+                if size + dictionary.nbytes > self.max_bytes:
+                    logger.warning(f"Rule corpus {self.max_bytes // (1024 * 1024)} MB sınırını aşıyor, önbelleğe alınmadı")
+                    self.over_capacity = True
+                    return None
+                features.append(rule_features)
+                documents.append(stub)
+        except errors.PyMongoError as e:
+            raise ConnectionError(f"MongoDB'den veri alınamadı: {e}")
+
+        size += dictionary.nbytes
+
+        logger.info(f"Rule corpus yüklendi: {len(documents)} kural, ~{size // 1024} KB (sürüm {self.version})")
+        return {"documents": documents, "features": features, "version": self.version}
+
+    def snapshot(self):
+        """Güncel corpus sözlüğü (documents, features, version; index/engine sonradan eklenir)"""
+        with self._lock:
+            if self._snapshot is None and not self.over_capacity:
+                self._snapshot = self.load()
+            return self._snapshot
+
+
+_corpora = {}
+_corpora_lock = threading.Lock()
+
+
+def get_rule_corpus(mongo_uri=None, db_name="sigmaDB", collection_name="rules", max_mb=DEFAULT_MAX_MB):
+    """Süreç genelinde paylaşılan RuleCorpus; bağlantı (uri, db, koleksiyon) başına bir kez kurulur"""
+    mongo_uri = mongo_uri or os.getenv("MONGO_URI")
+    key = (mongo_uri, db_name, collection_name)
+    with _corpora_lock:
+        corpus = _corpora.get(key)
+        if corpus is None:
+            connector = MongoConnector(mongo_uri, db_name, collection_name)
+            collection = connector.connect()
+            if collection is None:
+                raise ConnectionError("MongoDB bağlantısı kurulamadı")
+            corpus = RuleCorpus(collection, max_mb=max_mb, connector=connector)
+            _corpora[key] = corpus
+        return corpus
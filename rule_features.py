@@ -0,0 +1,90 @@
+import sys
+import threading
+from array import array
+
+
+class ValueDictionary:
+    """Value string'lerini bir kez saklayıp her birine sabit bir tamsayı id veren sözlük.
+
+    Aynı value yüzlerce kuralda geçse de bellekte tek kopyası bulunur; kurallar
+    sadece id dizisi tutar. Uzunluklar da burada bir kez hesaplanır, böylece
+    skorlamadaki uzunluk üst sınırı için value'lara tekrar dokunulmaz. Her
+    corpus yüklemesi kendi sözlüğünü kurar; snapshot bırakılınca sözlük de
+    serbest kalır. nbytes, saklanan string'lerin yaklaşık bellek kullanımıdır.
+    """
+
+    __slots__ = ("values", "index", "lengths", "stripped_lengths", "nbytes", "_lock")
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+        self.lengths = array("I")
+        self.stripped_lengths = array("I")
+        self.nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.values)
+
+    def id_of(self, value):
+        value_id = self.index.get(value)
+        if value_id is not None:
+            return value_id
+
+        with self._lock:
+            value_id = self.index.get(value)
+            if value_id is None:
+                value = sys.intern(str(value))
+                value_id = len(self.values)
+                self.values.append(value)
+                lowered = value.lower()
+                self.lengths.append(len(lowered))
+                self.stripped_lengths.append(len(lowered.strip()))
+                self.index[value] = value_id
+                self.nbytes += sys.getsizeof(value)
+            return value_id
+
+    def encode(self, values):
+        return array("I", (self.id_of(v) for v in values))
+
+
+class RuleFeatures:
+    """Bir kuralın field/value feature'larının kompakt hali.
+
+    Field isimleri intern edilmiş string tuple'ı, value'lar ise corpus'un
+    ValueDictionary'sindeki id'lerin array('I') dizisi olarak tutulur. Eski
+    (fields, values) tuple'ı gibi açılabilir ve indekslenebilir; bu yollar
+    value'ları her seferinde çözer, sıcak döngüler value_ids'i kullanmalıdır.
+    """
+
+    __slots__ = ("fields", "value_ids", "dictionary")
+
+    def __init__(self, fields, values, dictionary):
+        self.fields = tuple(sys.intern(str(f)) for f in fields)
+        self.value_ids = dictionary.encode(values)
+        self.dictionary = dictionary
+
+    @property
+    def values(self):
+        values = self.dictionary.values
+        return [values[i] for i in self.value_ids]
+
+    @property
+    def nbytes(self):
+        """id dizisinin bayt cinsinden boyutu (value string'leri sözlükte sayılır)"""
+        return self.value_ids.itemsize * len(self.value_ids)
+
+    def length_profile(self):
+        """length_profile(values) ile aynı; uzunluklar sözlükte önceden hesaplı"""
+        lengths, stripped = self.dictionary.lengths, self.dictionary.stripped_lengths
+        return {(lengths[i], stripped[i]) for i in self.value_ids}
+
+    def __iter__(self):
+        yield self.fields
+        yield self.values
+
+    def __getitem__(self, position):
+        return (self.fields, self.values)[position]
+
+    def __len__(self):
+        return 2
@@ -1,12 +1,25 @@
 import yaml
+import heapq
+import itertools
 import pymongo
+from pymongo import UpdateOne
+from bson import ObjectId
 import re
 from difflib import SequenceMatcher
 from collections import Counter
-from mongodb_connection import MongoConnector
+from functools import lru_cache
+from mongodb_connection import MongoConnector, stream_documents
+from ngram_index import NgramIndex
+from vector_engine import VectorSimilarityEngine
+from result_cache import query_fingerprint, corpus_identity
+from rule_features import RuleFeatures, ValueDictionary
+from query_stats import QueryStats, QueryProfiler
+import time
 import logging
 import requests
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,16 +27,389 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Kurallarla birlikte saklanan detection feature'larının anahtarı ve versiyonu.
+# clean_field / clean_value / extract_detection_components çıktısını değiştiren
+# her düzenlemede FEATURE_VERSION artırılmalı, aksi halde eski feature'lar okunur.
+FEATURES_KEY = "detection_features"
+FEATURE_VERSION = 1
+
+# Skorlama sırasında sadece bu alanlar çekilir; tam kural yalnızca son top_n için getirilir.
+# detection, feature'ı eksik/eski kurallar için yedek olarak gereklidir.
+SCORING_PROJECTION = {"title": 1, "detection": 1, "logsource": 1, "tags": 1, FEATURES_KEY: 1}
+# Bellekteki corpus'larda dokümanın sadece bu alanları tutulur (sonuç, bölüm ve tag skoru için)
+STUB_KEYS = ("_id", "title", "logsource", "tags")
+
+# Blocking: kurallar logsource (product/category/service) ve ATT&CK teknik tag'lerine göre bölümlenir
+LOGSOURCE_KEYS = ("product", "category", "service")
+_TECHNIQUE_TAG_PATTERN = re.compile(r'^attack\.t\d{4}(\.\d{3})?$')
+
+# Ağırlıklı toplam ve sonuç eşiği
+VALUE_WEIGHT = 0.8
+FIELD_WEIGHT = 0.2
+SIMILARITY_THRESHOLD = 0.5
+
+# "exact": her kural fuzzy_similarity ile skorlanır (referans davranış)
+# "indexed": n-gram ters indeksiyle query ile ortak n-gram'ı az olan kurallar önceden elenir (yaklaşık)
+# "vector": TF-IDF n-gram matrisleriyle tüm corpus tek matris çarpımıyla skorlanır
+SCORING_MODES = ("exact", "indexed", "vector")
+
+# Bu sayıdan az kural skorlanacaksa süreç havuzu kurmak kazandırmaz, seri çalışılır
+PARALLEL_MIN_RULES = 2000
+
+# Exact modda cursor'dan tek seferde okunan doküman sayısı
+DEFAULT_BATCH_SIZE = 500
+
+# (query value, corpus value) skor önbelleği bu boyutu aşınca boşaltılır; corpus büyüdükçe bellek büyümez
+PAIR_CACHE_MAX_ENTRIES = 100000
+
+def logsource_signature(rule):
+    """Kuralın tanımlı logsource bileşenleri (ör. {"product": "windows", "category": "process_creation"})"""
+    logsource = rule.get("logsource")
+    if not isinstance(logsource, dict):
+        return {}
+    return {k: str(logsource[k]) for k in LOGSOURCE_KEYS if logsource.get(k)}
+
+
+def attack_tags(rule):
+    """Kuralın MITRE ATT&CK tag'leri (attack.* ile başlayanlar, küçük harf)"""
+    tags = rule.get("tags")
+    if not isinstance(tags, list):
+        return set()
+    return {str(t).lower() for t in tags if str(t).lower().startswith("attack.")}
+
+
+def build_partition(rule):
+    """Query kuralının blocking anahtarları: logsource imzası ve teknik tag'leri"""
+    techniques = {t for t in attack_tags(rule) if _TECHNIQUE_TAG_PATTERN.match(t)}
+    return {"logsource": logsource_signature(rule), "techniques": techniques}
+
+
+def partition_filter(partition):
+    """Uyumlu bölüm için Mongo filtresi; blocking anahtarı yoksa None.
+
+    Uyumlu kural: query'de tanımlı her logsource bileşeninde ya aynı değere sahip ya da
+    o bileşeni hiç tanımlamamış kural; veya query ile en az bir ATT&CK tekniği paylaşan kural.
+    """
+    clauses = []
+    if partition["logsource"]:
+        clauses.append({"$and": [
+            {f"logsource.{k}": {"$in": [None, "", v]}} for k, v in partition["logsource"].items()
+        ]})
+    if partition["techniques"]:
+        clauses.append({"tags": {"$in": sorted(partition["techniques"])}})
+
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def in_partition(partition, doc):
+    """partition_filter'ın bellekteki dokümanlar için karşılığı"""
+    if not partition["logsource"] and not partition["techniques"]:
+        return True
+
+    if partition["logsource"]:
+        signature = logsource_signature(doc)
+        if all(signature.get(k) in (None, v) for k, v in partition["logsource"].items()):
+            return True
+
+    return bool(partition["techniques"] & attack_tags(doc))
+
+
+def combine_scores(field_sim, value_sim, tag_sim=0.0, tag_weight=0.0):
+    """Ağırlıklı toplam (%80 value, %20 field); tag_weight > 0 ise tag örtüşmesi de katılır"""
+    weighted_similarity = (value_sim * VALUE_WEIGHT) + (field_sim * FIELD_WEIGHT)
+    if tag_weight:
+        weighted_similarity = (weighted_similarity * (1 - tag_weight)) + (tag_sim * tag_weight)
+    return weighted_similarity
+
+
+# Normalizasyon sonuçları ham string'e göre süreç boyunca önbelleklenir
+NORMALIZE_CACHE_SIZE = 65536
+
+# Dosya uzantıları (executable, script, archive, document formats)
+_FILE_EXTENSIONS = frozenset([
+    # Executable files
+    '.exe', '.dll', '.sys', '.drv', '.ocx', '.cpl', '.scr', '.com', '.pif',
+    # Script files
+    '.bat', '.cmd', '.ps1', '.psm1', '.psd1', '.vbs', '.vbe', '.js', '.jse',
+    '.wsh', '.wsf', '.hta', '.py', '.pl', '.php', '.rb', '.sh',
+    # Archive files
+    '.zip', '.rar', '.7z', '.tar', '.gz', '.bz2', '.xz', '.cab', '.msi',
+    # Document files
+    '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.rtf',
+    # Log and config files
+    '.txt', '.log', '.cfg', '.conf', '.ini', '.xml', '.json', '.yaml', '.yml',
+    # Image files
+    '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.ico', '.svg',
+    # Other common files
+    '.tmp', '.temp', '.bak', '.old', '.orig'
+])
+
+# Temizlenecek field prefixleri ve suffixleri, sırası korunarak (tür, pattern) şeklinde
+_FIELD_PATTERNS_TO_REMOVE = tuple(
+    ("prefix" if p.endswith('_') else "suffix" if p.startswith('_') else "exact", p)
+    for p in [
+        # Sigma detection yapıları
+        'selection', 'filter', 'condition', 'timeframe',
+        # Selection varyantları
+        'selection_', 'sel_', 'select_',
+        # Filter varyantları
+        'filter_', 'filt_', 'exclude_',
+        # Diğer yaygın Sigma yapıları
+        'keywords', 'keyword_', 'pattern_', 'rule_',
+        'detection_', 'detect_', 'match_', 'search_',
+        # Suffix'ler için
+        '_selection', '_filter', '_condition', '_rule'
+    ]
+)
+
+_TOKEN_PATTERN = re.compile(r'\b\w+\b|[^\w\s]')
+_WORD_PATTERN = re.compile(r'\w+')
+_PATH_QUOTE_PATTERN = re.compile(r'[\\\/\'"]+')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+_NUMERIC_SUFFIX_PATTERN = re.compile(r'_?\d+$')
+_FIELD_SPECIAL_PATTERN = re.compile(r'[\*\?\[\]{}()^$|\\]')
+_UNDERSCORE_PATTERN = re.compile(r'_+')
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_value(value):
+    """clean_value'nun string girdiler için önbellekli gövdesi"""
+    cleaned_value = value.lower().strip()
+
+    # Uzantıyı kaldır; listedeki her uzantı tek noktalı olduğundan son noktadan sonrası yeterli
+    dot = cleaned_value.rfind('.')
+    if dot != -1 and cleaned_value[dot:] in _FILE_EXTENSIONS:
+        cleaned_value = cleaned_value[:dot]
+
+    # Gereksiz karakterleri temizle
+    cleaned_value = _PATH_QUOTE_PATTERN.sub('', cleaned_value)  # Path separators ve quotes
+    cleaned_value = _WHITESPACE_PATTERN.sub(' ', cleaned_value)  # Çoklu boşlukları tek boşluğa çevir
+    cleaned_value = cleaned_value.strip()
+
+    return cleaned_value if cleaned_value else value  # Eğer tamamen boş kaldıysa orijinalini döndür
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_field(field):
+    """clean_field'ın string girdiler için önbellekli gövdesi"""
+    cleaned_field = field.lower().strip()
+
+    # Önce sayısal suffix'leri kaldır (selection1, filter2 gibi)
+    cleaned_field = _NUMERIC_SUFFIX_PATTERN.sub('', cleaned_field)
+
+    # Prefix'leri kaldır
+    for kind, pattern in _FIELD_PATTERNS_TO_REMOVE:
+        if kind == "prefix":
+            if cleaned_field.startswith(pattern):
+                cleaned_field = cleaned_field[len(pattern):]
+                break  # İlk eşleşmede dur
+        elif kind == "suffix":
+            if cleaned_field.endswith(pattern):
+                cleaned_field = cleaned_field[:-len(pattern)]
+                break  # İlk eşleşmede dur
+        elif cleaned_field == pattern:  # Tam eşleşme
+            return ""  # Tamamen gereksiz field, boş döndür
+
+    # Pipe characters ve modifiers'ı temizle (Image|endswith → image)
+    if '|' in cleaned_field:
+        cleaned_field = cleaned_field.split('|')[0]
+
+    # Wildcard ve regex karakterlerini temizle
+    cleaned_field = _FIELD_SPECIAL_PATTERN.sub('', cleaned_field)
+
+    # Birden fazla underscore'u tek underscore'a çevir
+    cleaned_field = _UNDERSCORE_PATTERN.sub('_', cleaned_field)
+
+    # Başındaki ve sonundaki underscore'ları kaldır
+    cleaned_field = cleaned_field.strip('_')
+
+    return cleaned_field if cleaned_field else field  # Eğer tamamen boş kaldıysa orijinalini döndür
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def word_tokens(text):
+    """fuzzy_similarity'deki kelime/sayı ortaklığı kontrolü için token kümesi"""
+    return frozenset(_WORD_PATTERN.findall(text))
+
+
+@lru_cache(maxsize=4096)
+def pair_upper_bound(len1, stripped_len1, len2, stripped_len2):
+    """Sadece uzunluklara bakarak fuzzy_similarity'nin bir value çifti için verebileceği en yüksek skor.
+
+    len*: küçük harfli stringin uzunluğu (SequenceMatcher ve substring bonusu bunu kullanır)
+    stripped_len*: strip edilmiş uzunluk (is_meaningful_match bunu kullanır)
+    """
+    min_len, max_len = min(len1, len2), max(len1, len2)
+    if max_len == 0:
+        return 1.0
+
+    # SequenceMatcher.real_quick_ratio ile aynı üst sınır + verilebilecek en yüksek substring bonusu
+    length_ratio = min_len / max_len
+    bonus = 0.1 if length_ratio >= 0.5 else 0.05 if length_ratio >= 0.3 else 0.0
+    bound = min(1.0, (2.0 * min_len / (len1 + len2)) + bonus)
+
+    # is_meaningful_match 3+ karakterde uzunluk oranı < 0.4 veya skor < 0.5 olan çiftleri eler
+    stripped_min, stripped_max = min(stripped_len1, stripped_len2), max(stripped_len1, stripped_len2)
+    if stripped_min >= 3:
+        if stripped_min / stripped_max < 0.4 or bound < 0.5:
+            return 0.0
+    return bound
+
+
+def rule_stub(doc):
+    """Dokümanın bellekte tutulacak özeti; detection ve feature alanları atılır"""
+    return {k: doc[k] for k in STUB_KEYS if k in doc}
+
+
+def length_profile(values):
+    """Value'ların (küçük harf uzunluğu, strip edilmiş uzunluk) çiftleri"""
+    return [(len(str(v).lower()), len(str(v).lower().strip())) for v in values]
+
+
+class _Descending:
+    """Ters sıralı anahtar: heap'in en kötü girdisi eşit skorda büyük rule_id'li olsun diye"""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class TopNCollector:
+    """Eşiği geçen en iyi top_n sonucu sabit boyutlu bir min-heap'te tutar.
+
+    Eşit skorda küçük rule_id (str(_id)) kazanır; böylece kurallar hangi sırayla
+    taranırsa taransın (ör. uyumlu bölüm önce, paralel parçalar) sonuç aynıdır
+    ve bunun için corpus'taki pozisyonları okumak gerekmez.
+    """
+
+    def __init__(self, top_n, threshold=SIMILARITY_THRESHOLD):
+        self.top_n = top_n
+        self.threshold = threshold
+        self.heap = []
+        self.pruned = 0
+
+    def can_skip(self, upper_bound, rule_id=None):
+        """Üst sınırı eşiğin veya mevcut en kötü top_n sonucunun altında kalan kural atlanabilir.
+
+        rule_id verilmezse kuralın eşitlikte heap'tekilere kaybettiği varsayılır.
+        """
+        if upper_bound < self.threshold or self.top_n <= 0:
+            return True
+        if len(self.heap) < self.top_n:
+            return False
+        worst_score, worst_id = self.heap[0][0], self.heap[0][1].value
+        if rule_id is None:
+            return upper_bound <= worst_score
+        return upper_bound < worst_score or (upper_bound == worst_score and rule_id >= worst_id)
+
+    def accepts(self, score, rule_id):
+        """add(score, rule_id, ...) sonucu heap'e girer mi (payload kurmadan önce kontrol için)"""
+        if score < self.threshold or self.top_n <= 0:
+            return False
+        if len(self.heap) < self.top_n:
+            return True
+        worst_score, worst_id = self.heap[0][0], self.heap[0][1].value
+        return score > worst_score or (score == worst_score and rule_id < worst_id)
+
+    def add(self, score, rule_id, payload):
+        if not self.accepts(score, rule_id):
+            return
+        entry = (score, _Descending(rule_id), payload)
+        if len(self.heap) < self.top_n:
+            heapq.heappush(self.heap, entry)
+        else:
+            heapq.heapreplace(self.heap, entry)
+
+    def results(self):
+        """Skor azalan, eşitlikte rule_id sırasına göre payload listesi"""
+        return [payload for _, _, payload in sorted(self.heap, key=lambda e: (-e[0], e[1].value))]
+
+# Süreç havuzundaki worker'larda initializer ile bir kez kurulur
+_worker_comparator = None
+_worker_query = None
+_worker_pair_cache = None
+
+
+def _init_scoring_worker(yaml_fields, yaml_values, yaml_tags=frozenset(), tag_weight=0.0):
+    """Query feature'larını worker'a bir kez gönder"""
+    global _worker_comparator, _worker_query, _worker_pair_cache
+    _worker_comparator = SigmaRuleComparator(None, tag_weight=tag_weight)
+    _worker_query = (yaml_fields, yaml_values, yaml_tags)
+    _worker_pair_cache = {}
+
+
+def _score_chunk(chunk, top_n, threshold=SIMILARITY_THRESHOLD):
+    """Bir corpus parçasını skorla, eşiği geçen en iyi top_n sonucu döndür"""
+    yaml_fields, yaml_values, yaml_tags = _worker_query
+    collector = TopNCollector(top_n, threshold)
+    query_profile = length_profile(yaml_values)
+    counters = Counter()
+    if len(_worker_pair_cache) > PAIR_CACHE_MAX_ENTRIES:
+        _worker_pair_cache.clear()
+    cached_pairs = len(_worker_pair_cache)
+    for idx, doc, mongo_fields, mongo_values in chunk:
+        counters["rules_scanned"] += 1
+        pair_count = len(yaml_values) * len(mongo_values)
+        rule_id = str(doc["_id"])
+        try:
+            tag_sim = _worker_comparator.calculate_tag_similarity(yaml_tags, attack_tags(doc))
+            scores = _worker_comparator.score_features(
+                yaml_fields, yaml_values, mongo_fields, mongo_values, collector, query_profile, _worker_pair_cache,
+                tag_sim, rule_id=rule_id)
+        except Exception as e:
+            logger.warning(f"Kural {idx} işlenirken hata: {e}")
+            continue
+        if scores:
+            counters["rules_scored"] += 1
+            counters["pairs_compared"] += pair_count
+            field_sim, value_sim, weighted, value_matches = scores
+            collector.add(weighted, rule_id, (idx, doc, mongo_fields, mongo_values, field_sim, value_sim, tag_sim,
+                                              weighted, value_matches))
+        else:
+            counters["pairs_pruned"] += pair_count
+
+    counters["rules_pruned"] += collector.pruned
+    counters["pairs_scored"] += len(_worker_pair_cache) - cached_pairs
+
+    # Seri yoldaki sıralamayla aynı: skor azalan, eşitlikte rule_id
+    return collector.results(), counters
+
 class SigmaRuleComparator:
-    def __init__(self, collection):
+    def __init__(self, collection, mode="exact", workers=1, parallel_min_rules=PARALLEL_MIN_RULES,
+                 batch_size=DEFAULT_BATCH_SIZE, restrict_partition=False, tag_weight=0.0, rule_corpus=None,
+                 result_cache=None, on_stats=None, profile=False):
+        if mode not in SCORING_MODES:
+            raise ValueError(f"Geçersiz skorlama modu: {mode} (seçenekler: {', '.join(SCORING_MODES)})")
         self.collection = collection
+        self.mode = mode
+        self.workers = workers
+        self.parallel_min_rules = parallel_min_rules
+        self.batch_size = batch_size
+        self.restrict_partition = restrict_partition
+        self.tag_weight = tag_weight
+        self.rule_corpus = rule_corpus  # Süreç genelinde paylaşılan RuleCorpus (rule_corpus.py)
+        # Tekrarlanan query'ler için ResultCache (result_cache.py); sürüm RuleCorpus'tan geldiği için
+        # rule_corpus olmadan kullanılmaz (Mongo yazımlarından sonra bayat sonuç dönerdi)
+        self.result_cache = result_cache
+        self.on_stats = on_stats  # Her sorgudan sonra QueryStats ile çağrılır
+        self.profile = profile  # True ise sorgu cProfile altında çalışır
+        self.last_stats = None
+        self._corpus = None
     def tokenize_string(self, text):
         """String'i kelime ve özel karakterlere ayır"""
         if not text:
             return []
 
         # Kelimeler, sayılar, özel karakterleri ayrı ayrı yakala
-        tokens = re.findall(r'\b\w+\b|[^\w\s]', str(text).lower())
+        tokens = _TOKEN_PATTERN.findall(str(text).lower())
         return [token for token in tokens if token.strip()]
 
     def is_number(self, text):
@@ -39,93 +425,14 @@ class SigmaRuleComparator:
         """Value'lardan dosya uzantılarını ve gereksiz karakterleri temizle"""
         if not isinstance(value, str):
             return str(value)
-        
-        # Dosya uzantılarını kaldır (executable, script, archive, document formats)
-        file_extensions = [
-            # Executable files
-            '.exe', '.dll', '.sys', '.drv', '.ocx', '.cpl', '.scr', '.com', '.pif',
-            # Script files  
-            '.bat', '.cmd', '.ps1', '.psm1', '.psd1', '.vbs', '.vbe', '.js', '.jse',
-            '.wsh', '.wsf', '.hta', '.py', '.pl', '.php', '.rb', '.sh',
-            # Archive files
-            '.zip', '.rar', '.7z', '.tar', '.gz', '.bz2', '.xz', '.cab', '.msi',
-            # Document files
-            '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.rtf',
-            # Log and config files
-            '.txt', '.log', '.cfg', '.conf', '.ini', '.xml', '.json', '.yaml', '.yml',
-            # Image files
-            '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.ico', '.svg',
-            # Other common files
-            '.tmp', '.temp', '.bak', '.old', '.orig'
-        ]
-        
-        cleaned_value = value.lower().strip()
-        
-        # Uzantıları kaldır
-        for ext in file_extensions:
-            if cleaned_value.endswith(ext):
-                cleaned_value = cleaned_value[:-len(ext)]
-                break
-        
-        # Gereksiz karakterleri temizle
-        cleaned_value = re.sub(r'[\\\/\'"]+', '', cleaned_value)  # Path separators ve quotes
-        cleaned_value = re.sub(r'\s+', ' ', cleaned_value)  # Çoklu boşlukları tek boşluğa çevir
-        cleaned_value = cleaned_value.strip()
-        
-        return cleaned_value if cleaned_value else value  # Eğer tamamen boş kaldıysa orijinalini döndür
+        return normalize_value(value)
+
     def clean_field(self, field):
         """Field isimlerinden gereksiz Sigma yapılarını temizle"""
         if not isinstance(field, str):
             return str(field)
-        
-        # Temizlenecek field prefixleri ve suffixleri
-        field_patterns_to_remove = [
-            # Sigma detection yapıları
-            'selection', 'filter', 'condition', 'timeframe',
-            # Selection varyantları  
-            'selection_', 'sel_', 'select_',
-            # Filter varyantları
-            'filter_', 'filt_', 'exclude_',
-            # Diğer yaygın Sigma yapıları
-            'keywords', 'keyword_', 'pattern_', 'rule_',
-            'detection_', 'detect_', 'match_', 'search_',
-            # Suffix'ler için
-            '_selection', '_filter', '_condition', '_rule'
-        ]
-        
-        cleaned_field = field.lower().strip()
-        
-        # Önce sayısal suffix'leri kaldır (selection1, filter2 gibi)
-        cleaned_field = re.sub(r'_?\d+$', '', cleaned_field)
-        
-        # Prefix'leri kaldır
-        for pattern in field_patterns_to_remove:
-            if pattern.endswith('_'):  # Prefix pattern
-                if cleaned_field.startswith(pattern):
-                    cleaned_field = cleaned_field[len(pattern):]
-                    break  # İlk eşleşmede dur
-            elif pattern.startswith('_'):  # Suffix pattern  
-                if cleaned_field.endswith(pattern):
-                    cleaned_field = cleaned_field[:-len(pattern)]
-                    break  # İlk eşleşmede dur
-            else:  # Tam eşleşme
-                if cleaned_field == pattern:
-                    return ""  # Tamamen gereksiz field, boş döndür
-        
-        # Pipe characters ve modifiers'ı temizle (Image|endswith → image)
-        if '|' in cleaned_field:
-            cleaned_field = cleaned_field.split('|')[0]
-        
-        # Wildcard ve regex karakterlerini temizle
-        cleaned_field = re.sub(r'[\*\?\[\]{}()^$|\\]', '', cleaned_field)
-        
-        # Birden fazla underscore'u tek underscore'a çevir
-        cleaned_field = re.sub(r'_+', '_', cleaned_field)
-        
-        # Başındaki ve sonundaki underscore'ları kaldır
-        cleaned_field = cleaned_field.strip('_')
-        
-        return cleaned_field if cleaned_field else field  # Eğer tamamen boş kaldıysa orijinalini döndür
+        return normalize_field(field)
+
     def extract_detection_components(self, detection_dict):
         """Detection bölümünden field'ları ve değerleri ayrı ayrı çıkar"""
         fields = set()
@@ -163,6 +470,40 @@ class SigmaRuleComparator:
         recursive_extract(detection_dict)
         return list(fields), values
 
+    def build_rule_features(self, rule):
+        """Kuralın temizlenmiş field/value'larını versiyon damgasıyla birlikte üret"""
+        fields, values = self.extract_detection_components(rule.get("detection") or {})
+        return {"version": FEATURE_VERSION, "fields": fields, "values": values}
+
+    def get_rule_features(self, doc):
+        """Dokümandaki hazır feature'ları oku; yoksa veya versiyonu eskiyse yeniden çıkar"""
+        features = doc.get(FEATURES_KEY)
+        if isinstance(features, dict) and features.get("version") == FEATURE_VERSION:
+            return features.get("fields", []), features.get("values", [])
+        return self.extract_detection_components(doc.get("detection") or {})
+
+    def backfill_features(self, batch_size=500):
+        """Feature'ı eksik veya eski versiyonlu kuralları toplu olarak güncelle"""
+        query = {f"{FEATURES_KEY}.version": {"$ne": FEATURE_VERSION}}
+        operations = []
+        updated = 0
+
+        for doc in self.collection.find(query, {"detection": 1}):
+            features = self.build_rule_features(doc)
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {FEATURES_KEY: features}}))
+
+            if len(operations) >= batch_size:
+                self.collection.bulk_write(operations, ordered=False)
+                updated += len(operations)
+                operations = []
+
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+            updated += len(operations)
+
+        logger.info(f"{updated} kuralın detection feature'ları güncellendi (versiyon {FEATURE_VERSION})")
+        return updated
+
     def is_meaningful_match(self, s1, s2, score):
         """Eşleşmenin anlamlı olup olmadığını kontrol et"""
         s1_clean = str(s1).lower().strip()
@@ -236,60 +577,124 @@ class SigmaRuleComparator:
         
         return True
 
-    def fuzzy_similarity(self, strings1, strings2):
+    def _pair_score(self, s1, s2, s1_clean, s2_clean, matcher):
+        """Tek bir value çiftinin skoru; matcher'ın seq2'si s2_clean olarak ayarlı olmalı"""
+        len1, len2 = len(s1_clean), len(s2_clean)
+        stripped_len1, stripped_len2 = len(s1_clean.strip()), len(s2_clean.strip())
+        matcher.set_seq1(s1_clean)
+
+        # quick_ratio + en yüksek bonus 0.5'e ulaşamıyorsa is_meaningful_match zaten eleyecek
+        if min(stripped_len1, stripped_len2) >= 3:
+            length_ratio = min(len1, len2) / max(len1, len2)
+            max_bonus = 0.1 if length_ratio >= 0.5 else 0.05 if length_ratio >= 0.3 else 0.0
+            if matcher.quick_ratio() + max_bonus < 0.5:
+                return 0.0
+
+        fuzzy_score = matcher.ratio()
+
+        # Akıllı substring bonus - sadece anlamlı durumlarda ver
+        substring_bonus = 0.0
+        if s1_clean in s2_clean or s2_clean in s1_clean:
+            min_len = min(len1, len2)
+            max_len = max(len1, len2)
+
+            # Sadece uzunluk oranı makul ise bonus ver
+            length_ratio = min_len / max_len if max_len > 0 else 0
+            if length_ratio >= 0.5:  # En az %50 uzunluk oranı olmalı
+                substring_bonus = 0.1  # Daha düşük bonus
+            elif length_ratio >= 0.3:  # Orta seviye
+                substring_bonus = 0.05  # Çok düşük bonus
+
+        # Kelime/sayı ortaklığı varsa ve substring değilse -> ceza
+        penalty = 0.0
+        if substring_bonus == 0.0:
+            common_tokens = word_tokens(s1_clean) & word_tokens(s2_clean)
+
+            if any(token.isdigit() or token.isalpha() for token in common_tokens):
+                penalty = 0.3  # ceza uygula
+
+        combined_score = max(0.0, min(1.0, fuzzy_score + substring_bonus - penalty))
+
+        # Anlamlı eşleşme kontrolü - saçma eşleşmeleri filtrele
+        if not self.is_meaningful_match(s1, s2, combined_score):
+            combined_score = 0.0
+
+        return combined_score
+
+    def best_value_matches(self, strings1, strings2, pair_cache=None):
+        """strings1'deki her value için strings2'deki en iyi (skor, value) eşleşmesi.
+
+        Her strings2 value'su için tek bir SequenceMatcher kurulur (set_seq2 önbelleği)
+        ve tüm query value'ları ona karşı denenir. SequenceMatcher.ratio simetrik
+        olmadığından query value her zaman seq1 olarak kalır; skorlar birebir aynıdır.
+        pair_cache verilirse aynı çiftler sorgu boyunca tekrar hesaplanmaz.
+        """
+        queries = [(str(s1), str(s1).lower()) for s1 in strings1]
+        queries = [(s1, s1_clean, len(s1_clean), len(s1_clean.strip())) for s1, s1_clean in queries]
+        best = [(0.0, None)] * len(queries)
+
+        for s2 in strings2:
+            s2 = str(s2)
+            s2_clean = s2.lower()
+            len2, stripped_len2 = len(s2_clean), len(s2_clean.strip())
+            matcher = None
+
+            for i, (s1, s1_clean, len1, stripped_len1) in enumerate(queries):
+                key = (s1, s2)
+                score = pair_cache.get(key) if pair_cache is not None else None
+                if score is None:
+                    # Uzunluk oranı kuralı ve real_quick_ratio sınırı: anlamlı eşleşme imkansızsa matcher kurma
+                    if pair_upper_bound(len1, stripped_len1, len2, stripped_len2) == 0.0:
+                        score = 0.0
+                    else:
+                        if matcher is None:
+                            matcher = SequenceMatcher(None)
+                            matcher.set_seq2(s2_clean)
+                        score = self._pair_score(s1, s2, s1_clean, s2_clean, matcher)
+                    if pair_cache is not None:
+                        pair_cache[key] = score
+
+                if score > best[i][0]:
+                    best[i] = (score, s2)
+
+        return best
+
+    def best_id_matches(self, strings1, features, row_cache):
+        """best_value_matches'in RuleFeatures karşılığı; corpus value'ları id üzerinden işlenir.
+
+        row_cache her value id için tüm query value'larına karşı skor satırını
+        tutar (sorgu boyunca tek corpus sözlüğü kullanılır); value string'i sadece
+        ilk görüldüğünde okunur, sonraki kurallarda satır doğrudan kullanılır.
+        """
+        values = features.dictionary.values
+        best_scores = [0.0] * len(strings1)
+        best_ids = [None] * len(strings1)
+        for value_id in features.value_ids:
+            row = row_cache.get(value_id)
+            if row is None:
+                row = row_cache[value_id] = tuple(
+                    score for score, _ in self.best_value_matches(strings1, [values[value_id]]))
+            for i, score in enumerate(row):
+                if score > best_scores[i]:
+                    best_scores[i], best_ids[i] = score, value_id
+        return [(score, values[value_id] if value_id is not None else None)
+                for score, value_id in zip(best_scores, best_ids)]
+
+    def fuzzy_similarity(self, strings1, strings2, pair_cache=None):
         """İki string listesi arasındaki benzerliği hesapla (kelime/sayı benzerliği cezası dahil)"""
         # Input'ları liste haline getir
         if isinstance(strings1, str):
             strings1 = [strings1]
         if isinstance(strings2, str):
             strings2 = [strings2]
-            
+
         if not strings1 or not strings2:
             return 0.0
 
         total_score = 0.0
         comparisons = 0
 
-        for s1 in strings1:
-            best_score = 0.0
-            for s2 in strings2:
-                s1_clean = str(s1).lower()
-                s2_clean = str(s2).lower()
-
-                fuzzy_score = SequenceMatcher(None, s1_clean, s2_clean).ratio()
-
-                # Akıllı substring bonus - sadece anlamlı durumlarda ver
-                substring_bonus = 0.0
-                if s1_clean in s2_clean or s2_clean in s1_clean:
-                    min_len = min(len(s1_clean), len(s2_clean))
-                    max_len = max(len(s1_clean), len(s2_clean))
-                    
-                    # Sadece uzunluk oranı makul ise bonus ver
-                    length_ratio = min_len / max_len if max_len > 0 else 0
-                    if length_ratio >= 0.5:  # En az %50 uzunluk oranı olmalı
-                        substring_bonus = 0.1  # Daha düşük bonus
-                    elif length_ratio >= 0.3:  # Orta seviye
-                        substring_bonus = 0.05  # Çok düşük bonus
-
-                # Kelime/sayı ortaklığı varsa ve substring değilse -> ceza
-                penalty = 0.0
-                if substring_bonus == 0.0:
-                    s1_tokens = set(re.findall(r'\w+', s1_clean))
-                    s2_tokens = set(re.findall(r'\w+', s2_clean))
-                    common_tokens = s1_tokens & s2_tokens
-
-                    if any(token.isdigit() or token.isalpha() for token in common_tokens):
-                        penalty = 0.3  # ceza uygula
-
-                combined_score = max(0.0, min(1.0, fuzzy_score + substring_bonus - penalty))
-                
-                # Anlamlı eşleşme kontrolü - saçma eşleşmeleri filtrele
-                if not self.is_meaningful_match(s1, s2, combined_score):
-                    combined_score = 0.0
-
-                if combined_score > best_score:
-                    best_score = combined_score
-
+        for best_score, _ in self.best_value_matches(strings1, strings2, pair_cache):
             total_score += best_score
             comparisons += 1
 
@@ -305,117 +710,531 @@ class SigmaRuleComparator:
         union = len(set1.union(set2))
         return intersection / union if union > 0 else 0.0
 
-    def compare_with_mongodb(self, yaml_file_path, top_n=10):
-        """YAML dosyasını MongoDB'deki kurallarla karşılaştır"""
+    def calculate_tag_similarity(self, tags1, tags2):
+        """ATT&CK tag'lerinin benzerliği (Jaccard)"""
+        return self.calculate_field_similarity(tags1, tags2)
 
-        # YAML dosyasını oku
-        print("📄 YAML dosyası okunuyor...")
+    def load_corpus(self):
+        """Koleksiyonu belleğe alıp her kuralın feature'larını hazırla (indexed/vector modları)"""
         try:
-            with open(yaml_file_path, "r", encoding='utf-8') as f:
-                yaml_rule = yaml.safe_load(f)
-        except FileNotFoundError:
-            raise FileNotFoundError(f"YAML dosyası bulunamadı: {yaml_file_path}")
-        except yaml.YAMLError as e:
-            raise ValueError(f"YAML dosyası okunamadı: {e}")
-
-        yaml_detection = yaml_rule.get("detection", {})
-        yaml_fields, yaml_values = self.extract_detection_components(yaml_detection)
-
-        print(f"🔍 YAML'dan çıkarılan:")
-        print(f"   Fields: {yaml_fields}")
-        print(f"   Values: {yaml_values}")
-        print("-" * 60)
+            documents = list(self.collection.find({}, SCORING_PROJECTION))
+        except Exception as e:
+            raise ConnectionError(f"MongoDB'den veri alınamadı: {e}")
+
+        dictionary = ValueDictionary()
+        features = [RuleFeatures(*self.get_rule_features(doc), dictionary) for doc in documents]
+        self._corpus = {"documents": [rule_stub(doc) for doc in documents], "features": features}
+        return self._corpus
+
+    def current_corpus(self):
+        """Paylaşılan RuleCorpus varsa onun güncel snapshot'ı, yoksa comparator'ın kendi corpus'u"""
+        if self.rule_corpus is not None:
+            snapshot = self.rule_corpus.snapshot()
+            if snapshot is not None:
+                self._corpus = snapshot
+                return snapshot
+        return self._corpus or self.load_corpus()
+
+    def build_index(self, corpus=None):
+        """Bellekteki corpus için n-gram indeksini oluştur"""
+        corpus = corpus or self.current_corpus()
+        index = NgramIndex()
+        for position, (_, rule_values) in enumerate(corpus["features"]):
+            index.add(position, rule_values)
+
+        corpus["index"] = index
+        logger.info(f"N-gram indeksi {index.rule_count} kural için oluşturuldu ({len(index.postings)} n-gram)")
+        return index
+
+    def build_vector_engine(self, corpus=None):
+        """Bellekteki corpus için TF-IDF vektör motorunu oluştur"""
+        corpus = corpus or self.current_corpus()
+        corpus["engine"] = VectorSimilarityEngine().fit(corpus["features"])
+        logger.info(f"Vektör motoru {len(corpus['features'])} kural için oluşturuldu")
+        return corpus["engine"]
+
+    def indexed_candidates(self, yaml_fields, yaml_values, yaml_tags=frozenset(), corpus=None,
+                           threshold=SIMILARITY_THRESHOLD):
+        """Ortak n-gram sayısına göre eşiği geçmesi muhtemel kuralların corpus pozisyonları.
+
+        Yaklaşıktır: ortak n-gram'ı olmayan value çiftleri 0 sayılır, ama bu çiftler
+        de fuzzy skor alabilir; bu yüzden exact modda eşiği geçen bazı kurallar
+        burada elenebilir. Kesin sonuç için exact modu kullanın.
+        """
+        corpus = corpus or self.current_corpus()
+        index = corpus.get("index") or self.build_index(corpus)
+        if not yaml_values:
+            return []
+
+        candidates = []
+        for position, hits in index.candidate_hits(yaml_values).items():
+            # Ortak n-gram'ı olmayan query value'lar 0 sayılır (tahmin, kesin üst sınır değil)
+            value_estimate = hits / len(yaml_values)
+            field_sim = self.calculate_field_similarity(yaml_fields, corpus["features"][position].fields)
+            tag_sim = 0.0
+            if self.tag_weight:
+                tag_sim = self.calculate_tag_similarity(yaml_tags, attack_tags(corpus["documents"][position]))
+            estimate = combine_scores(field_sim, value_estimate, tag_sim, self.tag_weight)
+            if estimate >= threshold:
+                candidates.append(position)
+
+        return sorted(candidates)
+
+    def value_upper_bound(self, query_profile, mongo_values, mongo_profile=None):
+        """fuzzy_similarity(query, mongo_values) için sadece uzunluklardan hesaplanan üst sınır"""
+        if not query_profile or (not mongo_values and not mongo_profile):
+            return 0.0
+
+        if mongo_profile is None:
+            mongo_profile = set(length_profile(mongo_values))
+        if not mongo_profile:
+            return 0.0
+        total = 0.0
+        for len1, stripped_len1 in query_profile:
+            total += max(pair_upper_bound(len1, stripped_len1, len2, stripped_len2)
+                         for len2, stripped_len2 in mongo_profile)
+        return total / len(query_profile)
+
+    def score_features(self, yaml_fields, yaml_values, mongo_fields, mongo_values, collector=None, query_profile=None,
+                       pair_cache=None, tag_sim=0.0, mongo_profile=None, features=None, row_cache=None, rule_id=None):
+        """Field, value ve ağırlıklı benzerliği ile her query value'nun en iyi eşleşmesini hesapla.
+
+        Dönüş: (field_sim, value_sim, weighted, value_matches); value_matches her query
+        value için (skor, en iyi corpus value'su) listesidir ve açıklamalarda kullanılır.
+        collector verilirse önce ucuz bir üst sınır hesaplanır; kural eşiği veya
+        mevcut top_n'i geçemeyecekse value skorlaması yapılmadan None döner.
+        features (RuleFeatures) ve row_cache verilirse mongo_values kullanılmaz,
+        value'lar id üzerinden skorlanır. rule_id (str(_id)) budamada eşitlik sırası için kullanılır.
+        """
+        field_sim = self.calculate_field_similarity(yaml_fields, mongo_fields)
+
+        if collector is not None:
+            if query_profile is None:
+                query_profile = length_profile(yaml_values)
+            value_bound = self.value_upper_bound(query_profile, mongo_values, mongo_profile)
+            if collector.can_skip(combine_scores(field_sim, value_bound, tag_sim, self.tag_weight), rule_id):
+                collector.pruned += 1
+                return None
 
-        # MongoDB'den tüm kuralları al
-        print("🔍 MongoDB'den kurallar getiriliyor...")
+        # fuzzy_similarity ile aynı ortalama; eşleşmeler ikinci bir tarama yapılmasın diye saklanır
+        if features is not None and row_cache is not None:
+            value_matches = self.best_id_matches(yaml_values, features, row_cache) if yaml_values and features.value_ids else []
+        else:
+            value_matches = self.best_value_matches(yaml_values, mongo_values, pair_cache) if yaml_values and mongo_values else []
+        value_sim = sum(score for score, _ in value_matches) / len(value_matches) if value_matches else 0.0
+        return field_sim, value_sim, combine_scores(field_sim, value_sim, tag_sim, self.tag_weight), value_matches
+
+    def fetch_full_rules(self, rule_ids):
+        """Verilen _id'lerin tam dokümanlarını tek sorguda getir"""
+        if not rule_ids:
+            return {}
         try:
-            documents = list(self.collection.find())
-            print(f"📊 Toplam {len(documents)} kural bulundu")
+            return {doc["_id"]: doc for doc in self.collection.find({"_id": {"$in": list(rule_ids)}})}
         except Exception as e:
-            raise ConnectionError(f"MongoDB'den veri alınamadı: {e}")
-        similarity_results = []
+            logger.warning(f"Tam kurallar alınamadı: {e}")
+            return {}
 
-        for idx, doc in enumerate(documents, start=1):
-            try:
-                # MongoDB dokümanından detection bilgilerini çıkar
-                mongo_detection = doc.get("detection", {})
-                mongo_fields, mongo_values = self.extract_detection_components(mongo_detection)
-
-                # Benzerlik hesapla
-                field_sim = self.calculate_field_similarity(yaml_fields, mongo_fields)
-                value_sim = self.fuzzy_similarity(yaml_values, mongo_values)
-
-                # Ağırlıklı toplam (%80 value, %20 field)
-                weighted_similarity = (value_sim * 0.8) + (field_sim * 0.2)
-
-                similarity_results.append({
-                    "index": idx,
-                    "rule_id": str(doc.get("_id")),
-                    "title": doc.get("title", "Untitled"),
-                    "field_similarity": field_sim,
-                    "value_similarity": value_sim,
-                    "weighted_similarity": weighted_similarity,
-                    "mongo_fields": mongo_fields,
-                    "mongo_values": mongo_values,
-                    "full_rule": yaml.dump(doc)  # 👈 Tüm MongoDB'deki kuralı ekledik
-                })
+    def fetch_matched_rules(self, matches):
+        """Sonuçlardaki kuralların tam dokümanları, rule_id -> doküman (feature alanı olmadan)"""
+        rule_ids = [ObjectId(m["rule_id"]) if ObjectId.is_valid(m["rule_id"]) else m["rule_id"] for m in matches]
+        return {
+            str(rule_id): {k: v for k, v in doc.items() if k != FEATURES_KEY}
+            for rule_id, doc in self.fetch_full_rules(rule_ids).items()
+        }
+
+    def build_explanation(self, yaml_fields, yaml_values, mongo_fields, value_matches):
+        """Skorlama sırasında bulunan eşleşmelerden yapılandırılmış açıklama üret"""
+        return {
+            "matched_fields": sorted(set(yaml_fields) & set(mongo_fields)),
+            "value_matches": [
+                {"query_value": query_value, "best_match": best_match, "score": score}
+                for query_value, (score, best_match) in zip(yaml_values, value_matches)
+            ],
+        }
+
+    def _build_results(self, payloads, yaml_fields, yaml_values, stats):
+        """Top_n payload'larını sonuç sözlüklerine çevir; YAML sadece bunlar için render edilir"""
+        with stats.stage("full_rule_fetch"):
+            full_rules = self.fetch_full_rules([payload[1]["_id"] for payload in payloads])
+        results = []
+
+        for (idx, doc, mongo_fields, mongo_values, field_sim, value_sim, tag_sim, weighted_similarity,
+             value_matches) in payloads:
+            full_doc = full_rules.get(doc["_id"], doc)
+            if value_matches is None:
+                # Vector modunda fuzzy skorlama hiç çalışmaz; eşleşmeler sadece top_n için bir kez bulunur
+                value_matches = self.best_value_matches(yaml_values, mongo_values) if mongo_values else []
+            start = time.perf_counter()
+            full_rule = yaml.dump({k: v for k, v in full_doc.items() if k != FEATURES_KEY})
+            stats.add_time("yaml_dump", time.perf_counter() - start)
+            results.append({
+                "index": idx,
+                "rule_id": str(doc.get("_id")),
+                "title": doc.get("title", "Untitled"),
+                "field_similarity": field_sim,
+                "value_similarity": value_sim,
+                "tag_similarity": tag_sim,
+                "weighted_similarity": weighted_similarity,
+                "mongo_fields": list(mongo_fields),
+                "mongo_values": list(mongo_values),
+                "explanations": self.build_explanation(yaml_fields, yaml_values, mongo_fields, value_matches),
+                "full_rule": full_rule  # 👈 Tüm MongoDB'deki kuralı ekledik
+            })
+
+        return results
+
+    def _score_parallel(self, scoring_items, yaml_fields, yaml_values, yaml_tags, top_n, workers, chunk_size, stats,
+                        threshold=SIMILARITY_THRESHOLD):
+        """Corpus'u akarken parçalara bölüp süreç havuzunda skorla, kısmi top_n listelerini birleştir.
+
+        Havuzda en fazla workers * 2 parça bekler ve birleşik liste her adımda top_n'e
+        kırpılır; böylece bellek kullanımı corpus boyutundan bağımsız kalır.
+        """
+        partial = []
+        in_flight = set()
+
+        def merge(done):
+            nonlocal partial
+            for future in done:
+                chunk_results, chunk_counters = future.result()
+                partial.extend(chunk_results)
+                stats.counters.update(chunk_counters)
+            partial.sort(key=lambda r: (-r[7], str(r[1]["_id"])))
+            partial = partial[:max(top_n, 0)]
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_scoring_worker,
+                                 initargs=(yaml_fields, yaml_values, yaml_tags, self.tag_weight)) as pool:
+            chunk = []
+            for idx, doc, features, _ in scoring_items:
+                try:
+                    start = time.perf_counter()
+                    mongo_fields, mongo_values = features or self.get_rule_features(doc)
+                    stats.add_time("rule_features", time.perf_counter() - start)
+                except Exception as e:
+                    logger.warning(f"Kural {idx} işlenirken hata: {e}")
+                    continue
+
+                # Worker'a sadece sonuç ve tag skoru için gereken alanlar gider, detection gitmez
+                stub = {k: doc[k] for k in ("_id", "title", "tags") if k in doc}
+                chunk.append((idx, stub, mongo_fields, mongo_values))
 
+                if len(chunk) >= chunk_size:
+                    in_flight.add(pool.submit(_score_chunk, chunk, top_n, threshold))
+                    chunk = []
+                    if len(in_flight) >= workers * 2:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        merge(done)
+
+            if chunk:
+                in_flight.add(pool.submit(_score_chunk, chunk, top_n, threshold))
+            merge(in_flight)
+
+        return self._build_results(partial, yaml_fields, yaml_values, stats)
+
+    def _rank(self, yaml_fields, yaml_values, yaml_tags, partition, top_n, mode, workers, batch_size,
+              restrict_partition, stats, threshold=SIMILARITY_THRESHOLD):
+        """Query'yi seçilen modda corpus'a karşı skorlayıp en iyi top_n sonucu döndür"""
+        # İndeks ve vektör motoru corpus başına bir kez kurulur, sonraki sorgular yeniden kullanır.
+        # Paylaşılan RuleCorpus varsa bu yapılar tüm oturumlar arasında ortaktır.
+        with stats.stage("corpus_prepare"):
+            warm_corpus = self.rule_corpus.snapshot() if self.rule_corpus is not None and mode == "exact" else None
+            if mode == "indexed":
+                corpus = self.current_corpus()
+                if "index" not in corpus:
+                    self.build_index(corpus)
+            elif mode == "vector":
+                corpus = self.current_corpus()
+                if "engine" not in corpus:
+                    self.build_vector_engine(corpus)
+
+        if mode == "indexed":
+            documents = corpus["documents"]
+            with stats.stage("candidate_selection"):
+                candidates = self.indexed_candidates(yaml_fields, yaml_values, yaml_tags, corpus, threshold)
+            if restrict_partition:
+                candidates = [p for p in candidates if in_partition(partition, documents[p])]
+            logger.info(f"Toplam {len(documents)} kural, indeks ile {len(candidates)} aday seçildi")
+            scoring_items = [(position + 1, documents[position], corpus["features"][position], None)
+                             for position in candidates]
+        elif mode == "vector":
+            documents = corpus["documents"]
+            engine = corpus["engine"]
+            with stats.stage("candidate_selection"):
+                tag_scores = None
+                if self.tag_weight:
+                    tag_scores = [self.calculate_tag_similarity(yaml_tags, attack_tags(doc)) for doc in documents]
+                candidates = engine.top_candidates(yaml_fields, yaml_values, threshold,
+                                                   VALUE_WEIGHT, FIELD_WEIGHT, tag_scores, self.tag_weight)
+            if restrict_partition:
+                candidates = [c for c in candidates if in_partition(partition, documents[c[0]])]
+            logger.info(f"Toplam {len(documents)} kural, vektör motoru ile {len(candidates)} eşleşme bulundu")
+            scoring_items = [(position + 1, documents[position], corpus["features"][position], (field_sim, value_sim))
+                             for position, field_sim, value_sim in candidates]
+        elif warm_corpus is not None:
+            # Sıcak corpus: Mongo'ya gidilmez, uyumlu bölüm yine önce skorlanır.
+            # idx (sonuçtaki "index") tarama sırası değil doğal pozisyondur.
+            documents = warm_corpus["documents"]
+            compatible = [p for p, doc in enumerate(documents) if in_partition(partition, doc)]
+            if not restrict_partition:
+                compatible_set = set(compatible)
+                compatible += [p for p in range(len(documents)) if p not in compatible_set]
+            rule_count = len(compatible)
+            logger.info(f"Bellekteki {len(documents)} kuraldan {rule_count} kural taranacak")
+            scoring_items = [(p + 1, documents[p], warm_corpus["features"][p], None) for p in compatible]
+        else:
+            # Kurallar cursor'dan batch'ler halinde akar; koleksiyon belleğe alınmaz.
+            # Önce uyumlu logsource/ATT&CK bölümü taranır: yüksek skorlar heap'i erken
+            # doldurur ve geri kalan kurallarda üst sınır budaması daha çok işe yarar.
+            compatible = partition_filter(partition)
+            try:
+                with stats.stage("mongo_fetch"):
+                    if restrict_partition and compatible is not None:
+                        rule_count = self.collection.count_documents(compatible)
+                        queries = [compatible]
+                    else:
+                        rule_count = self.collection.estimated_document_count()
+                        queries = [{}] if compatible is None else [compatible, {"$nor": [compatible]}]
             except Exception as e:
-                logger.warning(f"Kural {idx} işlenirken hata: {e}")
-                continue
-        
-        filtered = [m for m in similarity_results if m['weighted_similarity'] >= 0.5]
-        if not filtered:
-            top_matches = []
+                raise ConnectionError(f"MongoDB'den veri alınamadı: {e}")
+            logger.info(f"MongoDB'den akış halinde ~{rule_count} kural taranacak")
+            documents = itertools.chain.from_iterable(
+                stream_documents(self.collection, query, SCORING_PROJECTION, batch_size=batch_size)
+                for query in queries
+            )
+            # Cursor'dan doküman bekleme süresi Mongo okuma aşamasına yazılır
+            documents = stats.timed(documents, "mongo_fetch")
+            # idx tarama sırasıdır; eşitlik sırası rule_id'den geldiği için bölümlemeden etkilenmez
+            scoring_items = ((idx, doc, None, None) for idx, doc in enumerate(documents, start=1))
+
+        candidate_count = rule_count if mode == "exact" else len(scoring_items)
+
+        # Vector modu zaten tek matris çarpımı; süreç havuzu sadece fuzzy skorlamada devreye girer
+        if mode != "vector" and workers > 1 and candidate_count >= self.parallel_min_rules:
+            logger.info(f"{candidate_count} kural {workers} süreçte skorlanıyor")
+            overlap_stages = ("mongo_fetch", "rule_features", "full_rule_fetch", "yaml_dump")
+            before = sum(stats.stages.get(s, 0.0) for s in overlap_stages)
+            start = time.perf_counter()
+            top_matches = self._score_parallel(scoring_items, yaml_fields, yaml_values, yaml_tags, top_n, workers,
+                                               max(1, batch_size // 2), stats, threshold)
+            # Mongo okuma, feature ve sonuç aşamaları ayrıca sayıldığı için paralel süreden düşülür;
+            # sadece bu aralıkta eklenenler düşülür (sayım ve pozisyon taraması start'tan önce)
+            elapsed = time.perf_counter() - start
+            overlap = sum(stats.stages.get(s, 0.0) for s in overlap_stages) - before
+            stats.add_time("parallel_scoring", max(0.0, elapsed - overlap))
         else:
-            # En yüksek benzerlikten başlayarak top_n kadar al
-            top_matches = sorted(filtered, key=lambda x: x['weighted_similarity'], reverse=True)[:top_n]
+            # Sadece en iyi top_n heap'te tutulur; üst sınırı yetmeyen kurallar value skorlamasına girmez
+            collector = TopNCollector(top_n, threshold)
+            query_profile = length_profile(yaml_values)
+            pair_cache = {}  # Aynı (query value, corpus value) çifti bir kez skorlanır (PAIR_CACHE_MAX_ENTRIES'e kadar)
+            row_cache = {}  # Bellekteki corpus'ta aynısı value id başına skor satırıyla yapılır
+            cleared_pairs = 0
+            counters = stats.counters
+            clock = time.perf_counter
+            feature_time = scoring_time = ranking_time = 0.0
 
-        print(f"\n🏆 EN BENZERLİK GÖSTEREN {top_n} KURAL:")
-        print("=" * 80)
+            for idx, doc, features, scores in scoring_items:
+                counters["rules_scanned"] += 1
+                rule_id = str(doc["_id"])
+                try:
+                    # Ingest sırasında saklanan feature'ları kullan (eksikse detection'dan çıkar)
+                    start = clock()
+                    if isinstance(features, RuleFeatures):
+                        # Value'lar çözülmez; skorlama id'ler üzerinden, çözme sadece heap'e girenler için
+                        mongo_fields, mongo_values = features.fields, None
+                    else:
+                        mongo_fields, mongo_values = features or self.get_rule_features(doc)
+                    tag_sim = self.calculate_tag_similarity(yaml_tags, attack_tags(doc))
+                    feature_time += clock() - start
 
+                    # Benzerlik hesapla (vector modunda skorlar matris çarpımından gelir)
+                    if scores:
+                        field_sim, value_sim = scores
+                        weighted_similarity = combine_scores(field_sim, value_sim, tag_sim, self.tag_weight)
+                        value_matches = None
+                    else:
+                        # Bellekteki RuleFeatures'ta value uzunlukları sözlükte hazır
+                        start = clock()
+                        if mongo_values is None:
+                            pair_count = len(yaml_values) * len(features.value_ids)
+                            scores = self.score_features(yaml_fields, yaml_values, mongo_fields, None, collector,
+                                                         query_profile, tag_sim=tag_sim,
+                                                         mongo_profile=features.length_profile(),
+                                                         features=features, row_cache=row_cache, rule_id=rule_id)
+                        else:
+                            pair_count = len(yaml_values) * len(mongo_values)
+                            scores = self.score_features(yaml_fields, yaml_values, mongo_fields, mongo_values,
+                                                         collector, query_profile, pair_cache, tag_sim, rule_id=rule_id)
+                            if len(pair_cache) > PAIR_CACHE_MAX_ENTRIES:
+                                cleared_pairs += len(pair_cache)
+                                pair_cache.clear()
+                        scoring_time += clock() - start
+                        if scores is None:
+                            counters["pairs_pruned"] += pair_count
+                            continue
+                        counters["pairs_compared"] += pair_count
+                        field_sim, value_sim, weighted_similarity, value_matches = scores
 
-        for i, match in enumerate(top_matches, 1):
-            print(f"\n{i}. 📋 {match['title']}")
-            print(f"   🆔 Rule ID: {match['rule_id']}")
-            print(f"   📊 TOPLAM BENZERLİK: {match['weighted_similarity']:.1%}")
-            print(f"   🔤 Value Benzerliği:  {match['value_similarity']:.1%}")
-            print(f"   🏷️  Field Benzerliği:  {match['field_similarity']:.1%}")
+                    counters["rules_scored"] += 1
+                    start = clock()
+                    if mongo_values is None:
+                        if not collector.accepts(weighted_similarity, rule_id):
+                            ranking_time += clock() - start
+                            continue
+                        mongo_values = features.values
+                    collector.add(weighted_similarity, rule_id,
+                                  (idx, doc, mongo_fields, mongo_values, field_sim, value_sim, tag_sim,
+                                   weighted_similarity, value_matches))
+                    ranking_time += clock() - start
 
-            # Detayları göster
-            print(f"   🔍 MongoDB Fields: {match['mongo_fields']}")
-            print(f"   🔍 MongoDB Values: {match['mongo_values'][:5]}...")
+                except Exception as e:
+                    logger.warning(f"Kural {idx} işlenirken hata: {e}")
+                    continue
 
-            # En iyi value eşleşmelerini göster
-            if match['value_similarity'] > 0.4:  # Daha yüksek threshold
-                print("   🎯 En İyi Value Eşleşmeleri:")
-                shown_matches = set()  # Tekrar eden eşleşmeleri engelle
-                
-                for yaml_val in yaml_values[:3]:  # İlk 3 YAML value
-                    best_match = ""
-                    best_score = 0.0
-                    
-                    for mongo_val in match['mongo_values']:
-                        score = self.fuzzy_similarity([str(yaml_val)], [str(mongo_val)])
-                        # Anlamlı eşleşme kontrolü ekle
-                        if score > best_score and self.is_meaningful_match(yaml_val, mongo_val, score):
-                            best_score = score
-                            best_match = mongo_val
-
-                    # Sadece gerçekten iyi ve benzersiz eşleşmeleri göster
-                    match_key = f"{yaml_val}↔{best_match}"
-                    if (best_score > 0.6 and  # Daha yüksek threshold
-                        match_key not in shown_matches and  # Tekrar kontrolü
-                        best_match):  # Boş değil
-                        shown_matches.add(match_key)
-                        print(f"      '{yaml_val}' ↔ '{best_match}' ({best_score:.1%})")
-
-            print("-" * 60)
+            stats.add_time("rule_features", feature_time)
+            stats.add_time("value_scoring", scoring_time)
+            with stats.stage("ranking"):
+                ranked = collector.results()
+            stats.add_time("ranking", ranking_time)
+            counters["rules_pruned"] += collector.pruned
+            counters["pairs_scored"] += cleared_pairs + len(pair_cache) + len(row_cache) * len(yaml_values)
+
+            # Tam kural ve YAML render'ı sadece son top_n için yapılır
+            top_matches = self._build_results(ranked, yaml_fields, yaml_values, stats)
+            logger.info(f"Üst sınır budaması ile {collector.pruned} kuralın value skorlaması atlandı")
+
+        return top_matches
+
+    def compare_with_mongodb(self, yaml_file_path, top_n=10, mode=None, workers=None, batch_size=None,
+                             restrict_partition=None, on_stats=None, profile=None, threshold=SIMILARITY_THRESHOLD):
+        """YAML dosyasını MongoDB'deki kurallarla karşılaştır.
+
+        Sadece ağırlıklı benzerliği `threshold`'u geçen kurallar döner.
+        Her sorgunun aşama süreleri ve sayaçları QueryStats olarak self.last_stats'a
+        yazılır ve verilmişse on_stats ile bildirilir; profile=True ise sorgu cProfile
+        altında çalışır ve özet stats.profile'da döner.
+        """
+        on_stats = on_stats or self.on_stats
+        profile = self.profile if profile is None else profile
+        stats = QueryStats()
+        with QueryProfiler(profile) as profiler:
+            top_matches = self._compare(yaml_file_path, top_n, mode, workers, batch_size, restrict_partition, stats,
+                                        threshold)
+        stats.profile = profiler.report()
+        self.last_stats = stats.finish()
+        if on_stats is not None:
+            on_stats(stats)
+        return top_matches
+
+    def compare_rule(self, yaml_rule, top_n=10, **kwargs):
+        """compare_with_mongodb ile aynı, ama dosya yerine ayrıştırılmış kural sözlüğü alır"""
+        return self.compare_with_mongodb(yaml_rule, top_n=top_n, **kwargs)
+
+    def _compare(self, yaml_source, top_n, mode, workers, batch_size, restrict_partition, stats,
+                 threshold=SIMILARITY_THRESHOLD):
+        mode = mode or self.mode
+        workers = workers or self.workers
+        batch_size = batch_size or self.batch_size
+        if restrict_partition is None:
+            restrict_partition = self.restrict_partition
+        if mode not in SCORING_MODES:
+            raise ValueError(f"Geçersiz skorlama modu: {mode} (seçenekler: {', '.join(SCORING_MODES)})")
+
+        # YAML dosyasını oku (compare_rule'dan gelen kural zaten sözlüktür)
+        if isinstance(yaml_source, dict):
+            yaml_rule = yaml_source
+        else:
+            try:
+                with stats.stage("yaml_parse"), open(yaml_source, "r", encoding='utf-8') as f:
+                    yaml_rule = yaml.safe_load(f)
+            except FileNotFoundError:
+                raise FileNotFoundError(f"YAML dosyası bulunamadı: {yaml_source}")
+            except yaml.YAMLError as e:
+                raise ValueError(f"YAML dosyası okunamadı: {e}")
+
+        with stats.stage("query_features"):
+            yaml_detection = yaml_rule.get("detection", {})
+            yaml_fields, yaml_values = self.extract_detection_components(yaml_detection)
+            yaml_tags = attack_tags(yaml_rule)
+            partition = build_partition(yaml_rule)
+
+        logger.info(f"YAML'dan çıkarılan fields: {yaml_fields}, values: {yaml_values}, "
+                    f"logsource: {partition['logsource']}, ATT&CK: {sorted(yaml_tags)}")
+
+        # Aynı (başlık/açıklama/tarih dışında) query tekrar gelirse corpus yeniden taranmaz
+        cache_key = None
+        corpus_version = self.rule_corpus.version if self.rule_corpus is not None else None
+        top_matches = None
+        if self.result_cache is not None and corpus_version is not None:
+            with stats.stage("cache_lookup"):
+                cache_key = query_fingerprint(yaml_fields, yaml_values, partition, yaml_tags, mode=mode, top_n=top_n,
+                                              restrict_partition=restrict_partition, tag_weight=self.tag_weight,
+                                              threshold=threshold, corpus=corpus_identity(self.collection))
+                top_matches = self.result_cache.get(cache_key, corpus_version)
+            if top_matches is not None:
+                stats.counters["cache_hit"] += 1
+                logger.info("Sonuçlar önbellekten getirildi")
+
+        if top_matches is None:
+            top_matches = self._rank(yaml_fields, yaml_values, yaml_tags, partition, top_n, mode, workers, batch_size,
+                                     restrict_partition, stats, threshold)
+            if cache_key is not None:
+                self.result_cache.put(cache_key, top_matches, corpus_version)
 
         return top_matches
 
+
+def print_report(top_matches, top_n):
+    """compare_with_mongodb sonuçlarını konsola yazdır (CLI)"""
+    print(f"\n🏆 EN BENZERLİK GÖSTEREN {top_n} KURAL:")
+    print("=" * 80)
+
+    for i, match in enumerate(top_matches, 1):
+        print(f"\n{i}. 📋 {match['title']}")
+        print(f"   🆔 Rule ID: {match['rule_id']}")
+        print(f"   📊 TOPLAM BENZERLİK: {match['weighted_similarity']:.1%}")
+        print(f"   🔤 Value Benzerliği:  {match['value_similarity']:.1%}")
+        print(f"   🏷️  Field Benzerliği:  {match['field_similarity']:.1%}")
+        print(f"   🎯 ATT&CK Tag Benzerliği: {match['tag_similarity']:.1%}")
+
+        # Detayları göster
+        print(f"   🔍 MongoDB Fields: {match['mongo_fields']}")
+        print(f"   🔍 MongoDB Values: {match['mongo_values'][:5]}...")
+
+        # En iyi value eşleşmeleri skorlama sırasında kaydedildi, burada tekrar hesaplanmaz
+        if match['value_similarity'] > 0.4:  # Daha yüksek threshold
+            print("   🎯 En İyi Value Eşleşmeleri:")
+            shown_matches = set()  # Tekrar eden eşleşmeleri engelle
+
+            for value_match in match['explanations']['value_matches'][:3]:  # İlk 3 YAML value
+                yaml_val, best_match, best_score = value_match['query_value'], value_match['best_match'], value_match['score']
+
+                # Sadece gerçekten iyi ve benzersiz eşleşmeleri göster
+                match_key = f"{yaml_val}↔{best_match}"
+                if (best_score > 0.6 and  # Daha yüksek threshold
+                    match_key not in shown_matches and  # Tekrar kontrolü
+                    best_match):  # Boş değil
+                    shown_matches.add(match_key)
+                    print(f"      '{yaml_val}' ↔ '{best_match}' ({best_score:.1%})")
+
+        print("-" * 60)
+
+
 # Kullanım
 def main():
+    parser = argparse.ArgumentParser(description="Sigma kuralını MongoDB'deki kurallarla karşılaştırır")
+    parser.add_argument("yaml_path", nargs="?", default="deneme_kural.yml", help="Karşılaştırılacak Sigma YAML dosyası")
+    parser.add_argument("--mode", choices=SCORING_MODES, default="exact", help="Skorlama modu")
+    parser.add_argument("--top-n", type=int, default=10, help="Gösterilecek en benzer kural sayısı")
+    parser.add_argument("--workers", type=int, default=1, help="Skorlama için süreç sayısı (1: seri)")
+    parser.add_argument("--restrict-partition", action="store_true",
+                        help="Sadece uyumlu logsource'taki veya ortak ATT&CK tekniği olan kuralları tara")
+    parser.add_argument("--tag-weight", type=float, default=0.0,
+                        help="ATT&CK tag örtüşmesinin ağırlıklı skordaki payı (0-1)")
+    parser.add_argument("--stats", action="store_true", help="Aşama sürelerini ve sayaçları göster")
+    parser.add_argument("--profile", action="store_true", help="Sorguyu cProfile ile çalıştırıp özetini göster")
+    args = parser.parse_args()
+
+    connect_mongo = None
     try:
         # MongoDB bağlantı string'ini buraya girin
         mongo_connection = os.getenv("MONGO_URI")
@@ -423,22 +1242,30 @@ def main():
         collect = connect_mongo.connect()
 
         # Comparator'ı başlat
-        comparator = SigmaRuleComparator(collect)
+        comparator = SigmaRuleComparator(collect, mode=args.mode, workers=args.workers,
+                                         restrict_partition=args.restrict_partition, tag_weight=args.tag_weight,
+                                         profile=args.profile)
 
         # YAML dosyasını karşılaştır
-        results = comparator.compare_with_mongodb("deneme_kural.yml", top_n=10)
+        results = comparator.compare_with_mongodb(args.yaml_path, top_n=args.top_n)
+        print_report(results, args.top_n)
+
+        if args.stats or args.profile:
+            print(f"\n{comparator.last_stats.format()}")
+        if args.profile:
+            print(f"\n🔬 cProfile özeti:\n{comparator.last_stats.profile}")
 
         # Özet istatistikler
         if results:
             print(f"\n📈 ÖZETİ:")
             print(f"   En yüksek benzerlik: {results[0]['weighted_similarity']:.1%}")
-            print(f"   En düşük (top 10): {results[-1]['weighted_similarity']:.1%}")
+            print(f"   En düşük (top {args.top_n}): {results[-1]['weighted_similarity']:.1%}")
             print(f"   Ortalama benzerlik: {sum(r['weighted_similarity'] for r in results) / len(results):.1%}")
         else:
             print("❌ Hiç benzer kural bulunamadı!")
 
     except FileNotFoundError:
-        print("❌ 'deneme_kural.yml' dosyası bulunamadı!")
+        print(f"❌ '{args.yaml_path}' dosyası bulunamadı!")
     except ConnectionError as e:
         print(f"❌ MongoDB bağlantı hatası: {e}")
     except Exception as e:
@@ -0,0 +1,126 @@
+import numpy as np
+from scipy import sparse
+
+from ngram_index import char_ngrams
+
+
+class VectorSimilarityEngine:
+    """Karakter n-gram TF-IDF vektörleriyle toplu benzerlik skorlaması.
+
+    Corpus'taki tüm value'lar tek bir seyrek matriste tutulur; bir sorgu tüm
+    corpus'a karşı tek bir matris çarpımıyla skorlanır. Value benzerliği, her
+    query value için kuralın en yakın value'suyla kosinüs benzerliğinin
+    ortalamasıdır; field benzerliği exact moddaki Jaccard ile aynıdır.
+    Skorlar SequenceMatcher tabanlı fuzzy_similarity ile birebir aynı değildir.
+    """
+
+    def __init__(self, ngram_size=3):
+        self.ngram_size = ngram_size
+        self.rule_count = 0
+        self.vocabulary = {}
+        self.idf = None
+        self.unknown_idf = 1.0
+        self.value_matrix = None
+        self.value_rule = None
+        self.field_vocabulary = {}
+        self.field_matrix = None
+        self.field_counts = None
+
+    def fit(self, corpus_features):
+        """(fields, values) listesinden value ve field matrislerini oluştur"""
+        self.rule_count = len(corpus_features)
+        self.vocabulary = {}
+        self.field_vocabulary = {}
+
+        value_grams = []
+        value_rule = []
+        field_rows, field_cols = [], []
+
+        for position, (rule_fields, rule_values) in enumerate(corpus_features):
+            for value in rule_values:
+                grams = [self.vocabulary.setdefault(g, len(self.vocabulary))
+                         for g in char_ngrams(value, self.ngram_size)]
+                value_grams.append(grams)
+                value_rule.append(position)
+
+            for field in set(rule_fields):
+                field_rows.append(position)
+                field_cols.append(self.field_vocabulary.setdefault(field, len(self.field_vocabulary)))
+
+        # Binary TF; IDF sklearn'deki smooth_idf formülüyle aynı
+        counts = self._binary_matrix(value_grams, len(self.vocabulary))
+        value_count = counts.shape[0]
+        document_frequency = np.bincount(counts.indices, minlength=len(self.vocabulary))
+        self.idf = np.log((1 + value_count) / (1 + document_frequency)) + 1.0
+        self.unknown_idf = np.log(1 + value_count) + 1.0
+        self.value_matrix = self._normalize(counts.multiply(self.idf).tocsr())
+        self.value_rule = np.asarray(value_rule, dtype=np.int64)
+
+        self.field_matrix = sparse.csr_matrix(
+            (np.ones(len(field_rows)), (field_rows, field_cols)),
+            shape=(self.rule_count, len(self.field_vocabulary)),
+        )
+        self.field_counts = np.asarray(self.field_matrix.sum(axis=1)).ravel()
+        return self
+
+    def _binary_matrix(self, rows, width):
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(r) for r in rows])
+        indices = np.fromiter((c for r in rows for c in r), dtype=np.int64, count=int(indptr[-1]))
+        data = np.ones(len(indices))
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(rows), width))
+
+    def _normalize(self, matrix, norms=None):
+        if norms is None:
+            norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.diags(1.0 / norms) @ matrix
+
+    def transform_values(self, values):
+        """Query value'larını corpus uzayına taşı (corpus'ta olmayan n-gram'lar normu etkiler)"""
+        rows = []
+        norms = np.zeros(len(values))
+        for i, value in enumerate(values):
+            grams = char_ngrams(value, self.ngram_size)
+            known = [self.vocabulary[g] for g in grams if g in self.vocabulary]
+            unknown = len(grams) - len(known)
+            rows.append(known)
+            norms[i] = np.sqrt(np.sum(self.idf[known] ** 2) + unknown * self.unknown_idf ** 2)
+
+        matrix = self._binary_matrix(rows, len(self.vocabulary)).multiply(self.idf).tocsr()
+        return self._normalize(matrix, norms)
+
+    def score(self, query_fields, query_values):
+        """Tüm kurallar için (field_similarity, value_similarity) dizilerini döndür"""
+        field_sims = np.zeros(self.rule_count)
+        value_sims = np.zeros(self.rule_count)
+
+        query_field_set = set(query_fields)
+        if query_field_set:
+            query_vector = np.zeros(len(self.field_vocabulary))
+            for field in query_field_set:
+                if field in self.field_vocabulary:
+                    query_vector[self.field_vocabulary[field]] = 1.0
+            intersection = self.field_matrix @ query_vector
+            union = len(query_field_set) + self.field_counts - intersection
+            nonempty = self.field_counts > 0
+            field_sims[nonempty] = intersection[nonempty] / union[nonempty]
+
+        if query_values and self.value_matrix.shape[0]:
+            similarities = (self.transform_values(query_values) @ self.value_matrix.T).tocoo()
+            # Her query value için kural başına en iyi eşleşme
+            best = np.zeros((len(query_values), self.rule_count))
+            np.maximum.at(best, (similarities.row, self.value_rule[similarities.col]), similarities.data)
+            value_sims = np.clip(best, 0.0, 1.0).mean(axis=0)
+
+        return field_sims, value_sims
+
+    def top_candidates(self, query_fields, query_values, threshold, value_weight, field_weight,
+                       tag_scores=None, tag_weight=0.0):
+        """Ağırlıklı skoru eşiği geçen kuralları (pozisyon, field_sim, value_sim) olarak döndür"""
+        field_sims, value_sims = self.score(query_fields, query_values)
+        weighted = (value_sims * value_weight) + (field_sims * field_weight)
+        if tag_weight and tag_scores is not None:
+            weighted = (weighted * (1 - tag_weight)) + (np.asarray(tag_scores) * tag_weight)
+        positions = np.flatnonzero(weighted >= threshold)
+        return [(int(p), float(field_sims[p]), float(value_sims[p])) for p in positions]